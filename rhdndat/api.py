@@ -0,0 +1,21 @@
+'''
+Functions of rhdndat and rhdndat-rn that can be used from other programs, they never ask questions.
+get_romhacking_data and export_cache still print their warnings and errors to the console like the programs.
+
+    from rhdndat.api import load_dats, scan_library, MATCH
+
+    index = load_dats(Path('dats'))
+    for result in scan_library(Path('roms'), index):
+        if result.status == MATCH:
+            print(result.path, [game['name'] for game in result.games])
+
+The dat index returned by load_dats can be reused for any number of scans.
+'''
+from rhdndat.scan import (DEFAULT_EXTENSIONS, MATCH, UNDATTED, NO_CHECKSUM, PATCH_ERROR, INDEX_NOT_TEXT, TRACK_MISSING, TRACK_CHECKED,
+                          EXENotFoundError, PatchingError, CacheManifestError, Tools, ScanResult,
+                          find_dats, load_dats, getChecksumDict, find_tools, file_checksum, snapshot_dir, scan_library, export_cache, import_cache)
+from rhdndat.versioncheck import (VersionFileSyntaxError, VersionFileURLError, RHDNTRomRemovedError,
+                                  find_version_files, read_version_file, rhdn_session, get_romhacking_data)
+from rhdndat.audit import audit_library
+from rhdndat.softpatch import find_softpatches, apply_ips, apply_ups, apply_bps, apply_patch, softpatch_checksum
+from rhdndat.vcdiff import UnsupportedDeltaError, decode_vcdiff, vcdiff_producer
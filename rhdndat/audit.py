@@ -0,0 +1,176 @@
+import sys
+import json
+import typer
+from pathlib import Path
+from typing import Optional, List
+from rhdndat.common import warn, error, ok, link
+from rhdndat.scan import (DEFAULT_EXTENSIONS, INDEX_EXTENSIONS, MATCH, UNDATTED, PatchingError,
+                          find_tools, find_dats, getChecksumDict, scan_library)
+from rhdndat.softpatch import find_softpatches, softpatch_checksum
+
+def dat_games(index):
+    ''' returns a dict of dat path to the list of games of that dat in the dat index
+    '''
+    games = {}
+    seen = set()
+    for game in ( g for gs in index.values() for g in gs ):
+        if id(game) not in seen:
+            seen.add(id(game))
+            games.setdefault(game['origin'], []).append(game)
+    return games
+
+def misnamed(result, game):
+    ''' returns the list of names the rom should have in this game if the rom or its tracks
+        have a different name than in the game, or a empty list if the names are right
+    '''
+    suffix = result.path.suffix.lower()
+    roms = [ r['name'] for r in game.find_all('rom') ]
+    if result.index_txt:
+        #like rhdndat-rn, the first rom is the index file and the others are its tracks in order
+        names = [ Path(roms[0]).stem + suffix ] + roms[1:]
+        tracks = roms[1:]
+        if result.path.name != names[0] or len(result.files) != len(tracks):
+            return names
+        if any( t.name != r for t, r in zip(result.files, tracks) ):
+            return names
+        return []
+    #container files keep their extension, like in rhdndat-rn
+    if suffix == '.chd' or suffix == '.rvz':
+        names = [ Path(roms[0]).stem + suffix ]
+    else:
+        names = roms
+    if result.path.name not in names:
+        return names
+    return []
+
+def missing_roms(game, found, indexed):
+    ''' returns the names of the roms of game without a checksum in found,
+        the index file rom is not checksummed so it's only required if the game wasn't matched by a index file
+    '''
+    roms = game.find_all('rom')
+    if indexed:
+        roms = roms[1:]
+    return [ r['name'] for r in roms if r.get('sha1') not in found ]
+
+def audit_library(romdir, index, skip=[], ext=DEFAULT_EXTENSIONS, force=False, tools=None, snapshot=None, softpatches=False):
+    ''' returns a dict with the audit of the roms of romdir against the dat index:
+        'dats' maps each dat path to a dict with 'have' (list of {'game', 'files'} of the games with all their roms),
+        'partial' (list of {'game', 'files', 'missing'} of the games with only some of their roms, missing the rom names),
+        'missing' (list of game names) and 'misnamed' (list of {'game', 'file', 'expected'}), 'unknown' lists the files
+        not in any dat and 'errors' lists {'file', 'status', 'error'} of the files that couldn't be checked (including
+        the ones without checksum because of a missing tool). Paths are relative to romdir.
+        Only files without a cached checksum (or all if forced) are read, the arguments are the same as scan_library.
+        If softpatches, 'softpatched' lists {'file', 'patches', 'sha1', 'games'} with the checksum of each rom with
+        ips/ups/bps softpatches after applying them, and the {'dat', 'game'} it's in, or {'file', 'patches', 'error'}
+    '''
+    def relative(f):
+        try:
+            return f.relative_to(romdir).as_posix()
+        except ValueError as e:
+            return f.as_posix()
+    have = {}
+    found = {}
+    indexed = set()
+    bad_names = {}
+    unknown = []
+    errors = []
+    softpatched = []
+    for result in scan_library(romdir, index, skip, ext, force, tools, snapshot):
+        suffix = result.path.suffix.lower()
+        #index and container files are not softpatched
+        if softpatches and result.status in (MATCH, UNDATTED) and not (suffix in INDEX_EXTENSIONS or suffix == '.chd' or suffix == '.rvz'):
+            patches = find_softpatches(result.path)
+            if patches:
+                entry = { 'file': relative(result.path), 'patches': [ relative(p) for p in patches ] }
+                try:
+                    entry['sha1'] = softpatch_checksum(result.path, patches)
+                    entry['games'] = [ { 'dat': str(g['origin']), 'game': g['name'] } for g in index.get(entry['sha1'], []) ]
+                except (PatchingError, OSError) as e:
+                    entry['error'] = str(e)
+                softpatched.append(entry)
+        if result.status == UNDATTED:
+            unknown.append(relative(result.path))
+        elif result.status != MATCH:
+            errors.append({ 'file': relative(result.path), 'status': result.status, 'error': result.error })
+        else:
+            wrong = {}
+            for game in result.games:
+                have.setdefault(id(game), []).append(relative(result.path))
+                found.setdefault(id(game), set()).update(result.checksums)
+                if result.index_txt:
+                    indexed.add(id(game))
+                wrong.setdefault(game['origin'], []).append((game, misnamed(result, game)))
+            for origin, games in wrong.items():
+                #the rom is misnamed for a dat if it doesn't have the right name in any of its games in that dat
+                if all( expected for game, expected in games ):
+                    for game, expected in games:
+                        bad_names.setdefault(id(game), []).append({ 'game': game['name'], 'file': relative(result.path), 'expected': expected })
+    dats = {}
+    for origin, games in dat_games(index).items():
+        complete = []
+        partial = []
+        for g in games:
+            if id(g) in have:
+                missing = missing_roms(g, found[id(g)], id(g) in indexed)
+                if missing:
+                    partial.append({ 'game': g['name'], 'files': have[id(g)], 'missing': missing })
+                else:
+                    complete.append({ 'game': g['name'], 'files': have[id(g)] })
+        dats[str(origin)] = {
+            'have': complete,
+            'partial': partial,
+            'missing': [ g['name'] for g in games if id(g) not in have ],
+            'misnamed': [ m for g in games for m in bad_names.get(id(g), []) ]
+        }
+    report = { 'dats': dats, 'unknown': unknown, 'errors': errors }
+    if softpatches:
+        report['softpatched'] = softpatched
+    return report
+
+def auditor(romdir: Path = typer.Argument(..., exists=True, file_okay=False, dir_okay=True, readable=True, resolve_path=True, help='Directory to search for roms to audit.'),
+            xmlpath: Path = typer.Argument(..., exists=True, file_okay=True, dir_okay=True, readable=True, resolve_path=True, help='Xml dat file or directory to search for xml dat files to audit against.'),
+            skip: Optional[List[Path]] = typer.Option([], exists=True, file_okay=False, dir_okay=True, readable=True, resolve_path=True, help='Directory to skip, can be repeated.'),
+            ext: Optional[List[str]] = typer.Option(DEFAULT_EXTENSIONS, help='ROM extensions to audit, can be repeated. Note that you can ommit this argument to get the predefined list.'),
+            force: bool = typer.Option(False, '--force', help='Force a recalculation and store of checksum (on windows the calculation always happens).'),
+            output: Optional[Path] = typer.Option(None, '--output', dir_okay=False, resolve_path=True, help='Write the json report to this file instead of the standard output.'),
+            softpatches: bool = typer.Option(False, '--softpatches', help='Also report the checksum of roms with ips/ups/bps softpatches after applying them, and the dat game of the result (reads those roms).')
+            ):
+    """
+    rom auditor
+
+    rhdndat-audit reports for each .DAT the games you have, the games you have only some files of, the games missing, and the roms that have a different name than in the .DAT, plus the roms that are not in any .DAT, as json.
+
+    It uses and stores the same checksums as rhdndat-rn, so only roms without a stored checksum are read (in unix, not windows).
+
+    With --softpatches, roms with .ips, .bps, .ups softpatches (including the retroarch numbered softpatches) are also patched in memory to report the checksum of the result and if it's in a .DAT. The checksums in ups and bps patches are used to check the rom and the result.
+
+    To update this program to the latest release with pip installed, type:
+
+    pip install --force-reinstall rhdndat
+    """
+    tools = find_tools()
+    if not tools.dolphin:
+        warn(f'warn: rhdndat-audit needs dolphin-tool on its location, the current dir, or the OS path to audit rvz roms')
+    xmls = find_dats(xmlpath)
+    if not xmls:
+        error('Can\'t find xml dats in second argument')
+        raise typer.Abort()
+    if romdir in skip or any( (excluded in skip for excluded in romdir.parents) ):
+        error('Can\'t process any roms because ROMDIR argument is in one of the skipped directories')
+        raise typer.Abort()
+    report = audit_library(romdir, getChecksumDict(xmls), skip, ext, force, tools, softpatches=softpatches)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    for origin, dat in report['dats'].items():
+        ok(f'{Path(origin).name}: have {len(dat["have"])}, partial {len(dat["partial"])}, missing {len(dat["missing"])}, misnamed {len(dat["misnamed"])} {link(Path(origin).as_uri(),"(open datfile)")}')
+    if report['unknown']:
+        warn(f'warn: {len(report["unknown"])} roms are not in any dat')
+    if report['errors']:
+        error(f'error: {len(report["errors"])} roms could not be checked')
+    for patched in report.get('softpatched', []):
+        if 'error' in patched:
+            error(f'error: softpatch failed for {patched["file"]}, {patched["error"]}')
@@ -0,0 +1,36 @@
+#the modules for each command import this one, so it should stay cheap to import,
+#heavy dependencies are imported by the functions that need them.
+import os
+import sys
+from colorama import Fore, init
+init()
+
+def warn(string, end='\n'):
+    print(Fore.YELLOW + string + Fore.RESET, file=sys.stderr, end=end)
+def error(string, end='\n'):
+    print(Fore.RED + string + Fore.RESET, file=sys.stderr, end=end)
+def log(string, end='\n'):
+    print(Fore.BLUE + string + Fore.RESET, file=sys.stderr, end=end)
+def ok(string, end='\n'):
+    print(Fore.GREEN + string + Fore.RESET, file=sys.stderr, end=end)
+
+def hyperlinks_disabled():
+    # GNU standard: NO_TERM_HYPERLINKS (set to any value = disabled)
+    if os.getenv("NO_TERM_HYPERLINKS") is not None:
+        return True
+    # Chalk/CLI standard: FORCE_HYPERLINK=0
+    if os.getenv("FORCE_HYPERLINK") == "0":
+        return True
+    return False
+
+def link(uri, label=None, parameters=''):
+    '''
+    Found in github, windows console and many unix consoles trick to embeed hyperlinks/uri with text
+    https://gist.github.com/egmontkob/eb114294efbcd5adb1944c9f3cb5feda
+    '''
+    if label is None or hyperlinks_disabled():
+        label = uri
+    # OSC 8 ; params ; URI ST <name> OSC 8 ;; ST
+    escape_mask = '\033]8;{};{}\033\\{}\033]8;;\033\\'
+    return escape_mask.format(parameters, uri, label)
+
@@ -0,0 +1,386 @@
+import signal
+import typer
+from pathlib import Path
+from itertools import chain
+from typing import Optional, List
+from rhdndat.common import warn, error, log, ok, link
+from rhdndat.scan import (DEFAULT_EXTENSIONS, INDEX_EXTENSIONS, INDEX_NOT_TEXT, TRACK_CHECKED, TRACK_MISSING, PATCH_ERROR, UNDATTED, NO_CHECKSUM,
+                          CacheManifestError, find_tools, find_dats, getChecksumDict, snapshot_dir, scan_library, export_cache, import_cache)
+
+class InvalidGameError(Exception):
+    def __init__(self):
+        super().__init__()
+
+def check_and_rename(new_name, rom, index_txt, files, game):
+    ''' This will check that any file that will be renamed will not overwrite a existing file then rename
+    
+        extra files considered for renaming for the roms: sbi +
+        for index roms (cue/toc/gdi): all the track files, all rxdelta for track files (not index_files)
+        for non-index roms: rxdelta, pal, ips, ups, bps files (and the numeric extensions for those last 3)
+        
+        Do not attempt to rename m3u files because they can and often do have different names than the original roms.
+        Use instead a recreation script after renaming, like my own create_m3u : https://gist.github.com/i30817/ba37fbb2b3c6e34ff926ad833f465055
+    '''
+    rename_error = False
+    def print_err(file):
+        nonlocal rename_error
+        if not rename_error:
+            rename_error = True
+            error(f'error: rom rename would overwrite files in directory {link(file.parent.as_uri(),"(open dir)")}')
+        error(f' {file.name}')
+
+    torename_tracks = []
+    torename_main = []
+    newrom = rom.with_name(new_name)
+    for old, new in ( (rom, newrom), (rom.with_suffix('.sbi'), newrom.with_suffix('.sbi')) ):
+        if old != new and old.exists():
+            if new.exists():
+                print_err(new)
+            else:
+                torename_main.append((old, new))
+    #if it has index text, it has tracks
+    if index_txt:
+        roms_json = game.find_all('rom') #invariants were checked (first entry is indexfile and len(files) == len(roms_json))
+        roms_json.pop(0)                 #remove the cue/gdi/toc since it was renamed above
+        #check tracks
+        for oldtrc, r_json in zip(files, roms_json):
+            #oldtrc is absolute, so newtrc is too. Tracks do not use 'newrom' for the name but the dat entry
+            newtrc = oldtrc.with_name(r_json.get('name'))
+            for old, new in ( (oldtrc, newtrc), (oldtrc.with_suffix('.rxdelta'), newtrc.with_suffix('.rxdelta')) ):
+                if old != new and old.exists():
+                    if new.exists():
+                        print_err(new)
+                    else:
+                        torename_tracks.append((old, new))
+    else:
+        #uglier but allows me to check for a user error
+        softpatches = [ r for r in ( rom.with_suffix('.ips'), rom.with_suffix('.bps'), rom.with_suffix('.ups') ) if r.exists() ]
+        mainpatches = [ r for r in ( rom.with_suffix('.rxdelta'), rom.with_suffix('.pal') ) if r.exists() ]
+        if len(softpatches)>1:
+            warn(f'warn: more than one active softpatch format exists for this rom {link(rom.parent.as_uri(),"(open dir)")}')
+        for r in chain(mainpatches, softpatches):
+            new = newrom.with_suffix(r.suffix)
+            if r != new:
+                if new.exists():
+                    print_err(new)
+                else:
+                    torename_main.append((r,new))
+        #support for retroarch consecutive softpatches
+        #(not xdelta which isn't a softpatch format)
+        #until the numbered files do not exist.
+        for x in range(1, 100):
+            softpatches = [ r for r in ( rom.with_suffix(f'.ips{x}'), rom.with_suffix(f'.bps{x}'), rom.with_suffix(f'.ups{x}') ) if r.exists() ]
+            if not softpatches:
+                break
+            if len(softpatches)>1:
+                warn(f'warn: more than one active softpatch format exists for this rom {link(rom.parent.as_uri(),"(open dir)")}')
+            for softpatch in softpatches:
+                new = newrom.with_suffix(softpatch.suffix)
+                if softpatch != new:
+                    if new.exists():
+                        print_err(new)
+                    else:
+                        torename_main.append((softpatch,new))
+    if rename_error:
+        #don't change files if any error was posted, just move on
+        return
+    for old_track, new_track in torename_tracks:
+        old_track.rename(new_track)
+        ok(f'{old_track.name} -> {new_track.name}')
+        #replace the 'last part' of a filename
+        #this way it should't matter if the original
+        #was absolute or relative in the cue.
+        index_txt = index_txt.replace(old_track.name, new_track.name)
+    if index_txt:
+        #this is the cue/toc/gdi, guarded by the existence of index text,
+        #that only exists when it's those. Edit it before possible renames.
+        rom.write_text(index_txt, encoding='utf-8')
+    for old_main, new_main in torename_main:
+        old_main.rename(new_main)
+        ok(f'{old_main.name} -> {new_main.name}')
+
+def validate_dat_game(is_index_file, files, allowed_index_extensions, allowed_extensions, game):
+    '''returns (list[valid_rom_names], bool tracks_need_rename)
+    
+        throws error if first rom is not allowed extension for index files and it's a index file
+        throws error if number of tracks is different than expected number of tracks for index files
+        throws error if the number of roms with allowed extensions for non-index file doesn't match exactly the number of roms or is 0
+    '''
+    tracks_need_renaming = False
+    roms_with_extension = []
+    if is_index_file:
+        #use this strategy for validating implied order, check the first 'rom' is a index file
+        roms_json = game.find_all('rom') #ordered by track order, just like the cue parsing
+        first     = roms_json.pop(0)
+        name      = first.get('name')
+        if Path(name).suffix.lower() not in allowed_index_extensions:
+            error(f'error: matched game first entry is not a cue/toc/gdi (entry: {name}) {link(game["origin"],"(open datfile)")}')
+            raise InvalidGameError()
+        #the others are just tracks
+        if len(files) != len(roms_json):
+            error(f'error: matched game #tracks ({len(roms_json)}) != rom #tracks ({len(files)}) (game: {game["name"]}) {link(game["origin"],"(open datfile)")}')
+            raise InvalidGameError()
+        for t,r in zip(files, roms_json):
+            tracks_need_renaming = t.name != r['name']
+            if tracks_need_renaming:
+                break
+        roms_with_extension = [ first ]
+    else:
+        #for non-index games, the cases where there is more than one ROM are not forbidden
+        #but they are uniquified based on name and unknown extensions are filtered out
+        #(this is after the checksum was used, so finding the right ROM doesn't matter)
+        roms_with_extension = game.find_all('rom', attrs={"name": lambda n: Path(n).suffix.lower() in allowed_extensions})   
+        if not roms_with_extension:
+            warn(f'warn: unknown dat ROM extension "{Path(game.find("rom")["name"]).suffix.lower()}" {link(game["origin"],"(open datfile)")}')
+        roms_with_extension = {g["name"] : g for g in roms_with_extension}.values()
+    return (roms_with_extension, tracks_need_renaming)
+
+#this method might rename files.
+#since we use dats to get the possible new filenames from the 'rom name' entry
+#it shouldn't be possible to end up with illegal characters on windows though, unless i'm missing something.
+def renamer(romdir: Path = typer.Argument(..., exists=True, file_okay=False, dir_okay=True, readable=True, resolve_path=True, help='Directory to search for roms to rename.'),
+            xmlpath: Optional[Path] = typer.Argument(None, exists=True, file_okay=True, dir_okay=True, readable=True, resolve_path=True, help='Xml dat file or directory to search for xml dat files to use as source of new names (not needed to export or import the cache).'),
+            skip: Optional[List[Path]] = typer.Option([], exists=True, file_okay=False, dir_okay=True, readable=True, resolve_path=True, help='Directory to skip, can be repeated.'),
+            ext: Optional[List[str]] = typer.Option(DEFAULT_EXTENSIONS, help='ROM extensions to find names of, can be repeated. Note that you can ommit this argument to get the predefined list.'),
+            force: bool = typer.Option(False, '--force', help='Force a recalculation and store of checksum (on windows the calculation always happens).'),
+            norename: bool = typer.Option(False, '--no-rename', help='Check and store checksums only.'),
+            showhacks: bool = typer.Option(False, '--show-hacks', help='Show renames for files without parentheses (a good indicator for hacks, if you want to keep renames for translations anyway, keep the original name for them).'),
+            verbose: bool = typer.Option(False, '--verbose', help='Print more information about skipped roms.'),
+            checkversions: bool = typer.Option(False, '--check-versions', help='Also check the rhdndat.ver files found in ROMDIR for romhacking.net updates like rhdndat, without searching the directories twice.'),
+            exportcache: Optional[Path] = typer.Option(None, '--export-cache', dir_okay=False, resolve_path=True, help='Write the stored checksums of ROMDIR to a manifest file and exit.'),
+            importcache: Optional[Path] = typer.Option(None, '--import-cache', exists=True, dir_okay=False, readable=True, resolve_path=True, help='Store the checksums of a manifest file in the files of ROMDIR with the same relative path, size and modification time and exit (--force overwrites stored checksums).')
+            ):
+    """
+    rom renamer
+    
+    rhdndat-rn renames files and patches to new .DAT¹² rom names if it can find the rom checksum in those .DAT files and memorizes the checksum of the 'original rom' as a extended attribute user.rhdndat.rom_sha1 to speed up renaming in subsequent executions (in unix, not windows). The size and modification time are memorized too, so a rom that changed is read again.
+
+    To find the checksum of the original file for hardpatched roms, rhdndat-rn can support a custom convention for 'revert patches'. Revert patches are a patch that you apply to a hardpatched file to get the original. These have the same name as the file and extension '.rxdelta' and are done with xdelta3 (rhdndat-rn applies them itself). I keep them for patch updates for cd images (since delta chd support is rare).
+
+    rhdndat-rn will read a xml dat file or every dat file from a directory given, and ask for renaming for every match where the rom filename is not equal to the dat name proposed. It will skip the question if all the names proposed already exist in the rom directory, and not allow a rename to a existing file in the rom directory.
+
+    Besides bare rom files, files affected by renames are compressed wii/gamecube .rvz files, .cue/.toc/.gdi (treated especially to not ask for every track), the softpatch types .ips, .bps, .ups, including the new retroarch multiple softpatch convention (a number after the softpatch extension), .rxdelta, .pal NES color palettes, and sbi subchannel data files.
+    
+    No-intro recently changed its mind and all roms checksums in its dats no longer skip headers (regardless if they carry a headered and unheadered dat). To softpatch mismatching headers hacks, you can track down the right rom, hardpatch it, and create a softpatch from the current no-intro rom to the older patched rom. For sfc and pce ips hacks that target a headered rom I recommend ipsbehead³ to change the patch to target the no-header rom if possible.
+    
+    When you update a no-intro set, all romhacks roms should not be also updated because otherwise the hacks stop working and yet users are encouraged go keep the same directory platforms roms in the same base directory, including hacks (for for example, have a single canonical retroarch playlist) which makes rhdndat-rn scans complain about the massive mismatching roms from older sets to the new set. I dont really encourage keeping a single combined hacks and nointro same directory set, but I do have a solution to make rhdndat-rn stop complaining: create a .rxdelta patch from each affected rom, to the new nointro rom, which allows you to update names for translations at least, if you keep the original name for those.
+    
+    With --check-versions, the rhdndat.ver files found while searching for roms are also checked for romhacking.net updates like rhdndat does, which is faster than running both programs on big or network directories.
+
+    The stored checksums can be saved with --export-cache to a manifest file, and restored with --import-cache after copying the roms with a program or to a filesystem that doesn't keep extended attributes, without calculating the checksums again.
+
+    Requires dolphin-tool⁵ (to operate on rvz files) on path or the same directory, and xdelta3⁴ for rxdelta made with the non default djw or fgk secondary compression.    
+    ¹ scroll down and click 'prepare' to get a collection of cartrige rom .DAT files
+    
+    https://datomatic.no-intro.org/index.php?page=download&s=64&op=daily
+    
+    ² download cd/dvd roms .DAT files here
+    
+    http://redump.org/downloads/
+    
+    ³ https://github.com/heuripedes/ipsbehead
+    
+    ⁴ in windows download xdelta3 from here and rename it 'xdelta3.exe' and place in the path, in linux install xdelta3.
+    
+    https://github.com/jmacd/xdelta-gpl/releases
+    
+    ⁵ dolphin-tool is part of the dolphin emulator. In windows rename it 'dolphin-tool.exe', in linux you have to build it from source, then place it in the path.
+    
+    To update this program to the latest release with pip installed, type:
+    
+    pip install --force-reinstall rhdndat
+    """
+    tools = find_tools()
+    xattr = tools.xattr
+    if exportcache or importcache:
+        if exportcache and importcache:
+            error('Can\'t export and import the checksum cache at the same time')
+            raise typer.Abort()
+        if not xattr:
+            error('Can\'t export or import the checksum cache because extended attributes are not supported in this OS')
+            raise typer.Abort()
+        if exportcache:
+            count = export_cache(romdir, skip, exportcache, xattr)
+            ok(f'exported {count} checksums to {exportcache.name}')
+        else:
+            try:
+                imported, stale = import_cache(romdir, importcache, xattr, force)
+            except CacheManifestError as e:
+                error(f'error: not a rhdndat-rn cache manifest {link(e.manifest.as_uri(), "(open file)")}')
+                raise typer.Abort()
+            ok(f'imported {imported} checksums from {importcache.name}')
+            if stale:
+                warn(f'warn: {stale} manifest entries skipped because the file is missing or has a different size or modification time')
+        return
+    if not tools.dolphin:
+        warn(f'warn: rhdndat-rn needs dolphin-tool on its location, the current dir, or the OS path to rename rvz roms')
+    xmls = find_dats(xmlpath) if xmlpath else []
+    if not xmls:
+        error('Can\'t find xml dats in second argument')
+        raise typer.Abort()
+    if romdir in skip or any( (excluded in skip for excluded in romdir.parents) ):
+        error('Can\'t process any roms because ROMDIR argument is in one of the skipped directories')
+        raise typer.Abort()
+
+    combined_dict = getChecksumDict(xmls)
+    ext = list(map( lambda s: s.lower() if s.startswith('.') else '.' + s.lower(), ext))
+    sortd = INDEX_EXTENSIONS
+    snapshot = None
+    if checkversions:
+        from rhdndat.versioncheck import check_versions, find_version_files
+        #the same directory traversal is used for the version files and the roms
+        snapshot = snapshot_dir(romdir, skip)
+        #a version check failure shouldn't stop the renames
+        check_versions(find_version_files(romdir, snapshot=snapshot), verbose, abort=False)
+    for rom, files, checksums, games, status, index_txt, patch_error in scan_library(romdir, combined_dict, skip, ext, force, tools, snapshot):
+        suffix = rom.suffix.lower()
+        if status == INDEX_NOT_TEXT:
+            error(f'error: cue/toc/gdi file is not text {link(rom.as_uri(),"(open cue/toc/gdi)")} {link(rom.parent.as_uri(),"(open dir)")}')
+            continue
+        if status == TRACK_CHECKED:
+            error('error: track(s) were checked before, may be caused by a track file in a different directory subtree than its index file '
+                  f'{link(rom.as_uri(),"(open cue/toc/gdi)")} {link(rom.parent.as_uri(),"(open dir)")}')
+            continue
+        if status == TRACK_MISSING:
+            error('error: missing track(s), may be caused by corrupt file, or previous rename '
+                  f'{link(rom.as_uri(),"(open cue/toc/gdi)")} {link(rom.parent.as_uri(),"(open dir)")}')
+            continue
+        if status == PATCH_ERROR:
+            error(f'error: rxdelta patch failed ({patch_error}) {link(rom.parent.as_uri(),"(open dir)")}')
+            continue
+        if status == NO_CHECKSUM:
+            warn(f'warn: checksum could not be calculated, may be caused by missing dolphin-tool {link(rom.parent.as_uri(),rom.name + " (open dir)")}')
+            continue
+        if status == UNDATTED:
+            warn(f'incomplete/undatted: {link(rom.parent.as_uri(),rom.name + " (open dir)")} has no match in dats {link(xmlpath.as_uri(),"(open)")}')
+            continue
+        if norename or (not showhacks and '(' not in rom.name):
+            continue
+        
+        #prompt_toolkit is slow to import and only needed if there is something to ask
+        import questionary
+        from questionary import Style
+        
+        
+        #Jargon: chd/rvz are 'container' files, cue/toc/gdi are 'index' files.
+        #'games' are dat entries where all the roms searched matched.
+        #Neither container or index files are checked for being part of games.
+        #Container files for obvious reasons, and index files to allow different
+        #formats to still match the same data and the fact they embed filenames.
+        #They're also the only files that never can change extension for that reason.
+        
+        #unfortunately here is a big difference between dat files. Some of them (redump)
+        #place always one and only one 'complete' medium per 'game' (cue/bin being 1 too).
+        #for others, however, i found counterexamples like one where 2 isos are in a
+        #single 'game' (Legend of Heroes - Trails in the Sky - Second Chapter).
+        #This makes it problematic to find the new name in that unusual case.
+        
+        #Instead of doing a complicated and unstable strategy to 'make it perfect'
+        #simply find all the currently checked searched extensions in the 'game'
+        #and display all for the user to choose. If none are found, skip them.
+        #If any already exists disable them. If all are disabled skip them.
+        #In the case of index or container files, additionally replace the
+        #extensions found by the current one.
+        
+        will_replace_extension = suffix in sortd or suffix == '.chd' or suffix == '.rvz'
+        possibilities = [questionary.Choice('no')]
+        current_rom_was_in_dats = False
+        for x in games:
+            try:
+                valid_roms, tracks_need_renaming = validate_dat_game(index_txt, files, sortd, ext, x)
+            except InvalidGameError:
+                continue
+            names_to_show = (y['name'] for y in valid_roms)
+            if will_replace_extension:
+                names_to_show = map( lambda n: Path(n).stem + suffix,  names_to_show)
+            for name in names_to_show:
+                question = [('fg:green bold',name)]
+                if rom != Path(rom.parent, name):
+                    disable = False
+                    if Path(rom.parent, name).exists():
+                        question.append(('fg:grey bold',' (destination exists)'))
+                        disable = True
+                    possibilities.append(questionary.Choice(question, value=(name,x), disabled=disable))
+                elif tracks_need_renaming:
+                    question.append(('fg:red bold',' (current rom, tracks need rename)'))
+                    possibilities.append(questionary.Choice(question, value=(name,x), disabled=False))
+                else:#need to show that the current rom is valid otherwise user will think he 'has' to rename
+                    current_rom_was_in_dats = True
+                    question.append(('fg:grey bold',' (current rom)'))
+                    possibilities.append(questionary.Choice(question, value=(name,x), disabled=True))
+        #no game was added (or some were skipped because the dat was broken),
+        #without even any track renames to be done, skip
+        if all((x.disabled for x in possibilities[1:])):
+            if verbose and current_rom_was_in_dats:
+                log(f'log: {link(rom.parent.as_uri(),rom.name + " (open dir)")} appears to have the correct name')
+            elif verbose:
+                log(f'log: {link(rom.parent.as_uri(),rom.name + " (open dir)")} any possible name already exists in the dir')
+            continue
+        choice = questionary.select(f'rename {"(hack?) " if "(" not in rom.name else ""}{rom.name} ?',
+                                    possibilities,
+                                    style=Style([('answer', 'fg:green bold')]),
+                                    default=possibilities[0]).ask()
+        if choice == None: #user ctrl+c
+            raise typer.Exit(code=1)
+        if choice != 'no':
+            #ignore keyboard signal to not fuck up the renames of cues if using it
+            #(waits until it's out of the critical section, if you keep pressed)
+            previous_signal = signal.signal(signal.SIGINT, signal.SIG_IGN)
+            try:
+                new_name, game = choice
+                check_and_rename(new_name, rom, index_txt, files, game)
+            finally:
+                #reneable keyboard kills
+                if previous_signal:
+                    signal.signal(signal.SIGINT, previous_signal)
+
+#from chd import chd_read_header, chd_open, ChdError
+#from hashlib import sha1
+#def chd_sha1(chdfile: Path, possible_parents: List[Path] = []):
+#    '''
+#    Try to extract a list of sha1 sum strings from a chd that can be used on a dat file
+#    This method supports cd type chds (returns tracks sha1) and non-cd chd (returns chd sha1)
+#    But delta chd without all the ancestors in the list, or not a chd returns None
+#    '''
+#    parents_headers = [ chd_read_header(str(parent)) for parent in possible_parents ]
+#    try:
+#        headersmap = { str(path.resolve(strict=True)) : header for path, header in zip(possible_parents, parents_headers) }
+#        chdfile = str(chdfile.resolve(strict=True))
+#        headersmap[chdfile] = chd_read_header(chdfile)
+#        
+#        chd = bottom_up_chd_build(chdfile, headersmap)
+#        if not chd:
+#            return None
+#        
+#        tags = [ m.tag().to_bytes(4, byteorder='big') for m in chd.metadata() ]
+#        def is_cdrom(tag):
+#            return tag == b'CHCD' or tag == b'CHTR' or tag == b'CHT2' or tag == b'CHGT' or tag == b'CHGD'
+#        
+#        if not any(map(is_cdrom, tags)):
+#            return [headersmap[chdfile].sha1]
+#        
+#        #do sha1sum of tracks here, draw the rest of the owl
+#        checksum = sha1()
+#        
+#        for tag in tags:
+#            
+#        
+#        return chd
+#    except (FileNotFoundError, ChdError):
+#        return None
+
+#def bottom_up_chd_build(chdfile, headers):
+#    header = headers[chdfile]
+#    del headers[chdfile]
+#    if header.has_parent():
+#        try:
+#            parentfile, _ = next(filter(lambda kv: kv[1].sha1() == header.parent_sha1(), headers.items()))
+#            parentchd = bottom_up_chd_build(parentfile, headers)
+#            if parentchd:
+#                return chd_open(chdfile, parentchd)
+#            else:
+#                return None
+#        except StopIteration:
+#            return None
+#    else:
+#        return chd_open(chdfile)
@@ -0,0 +1,479 @@
+import os
+import re
+import json
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from hashlib import sha1
+from io import DEFAULT_BUFFER_SIZE
+from collections import defaultdict, OrderedDict
+from functools import reduce
+from typing import NamedTuple, Optional, List
+from rhdndat.common import warn, link
+
+#rom extensions rhdndat-rn checks by default
+DEFAULT_EXTENSIONS = ['a78', 'd64', 'crt', 'hdi', 'fdi', 'ngc', 'ws', 'wsc', 'pce', 'gb', 'gba', 'gbc', 'n64', 'v64', 'z64', '3ds', 'nds', 'nes', 'unh', 'lnx', 'fds', 'sfc', 'smc', 'bs', 'nsp', '32x', 'gg', 'sms', 'md', 'iso', 'dim', 'adf', 'ipf', 'dsi', 'wad', 'cue', 'gdi', 'toc', 'rvz']
+
+#cue/gdi/toc are 'index' files, that list track files.
+#zero is falsy so it shouldn't be used for the sort trick in scan_library
+INDEX_EXTENSIONS = { '.cue':1, '.gdi':2, '.toc':3 }
+
+#status of a ScanResult
+MATCH = 'match'                  #all the files of the rom are in at least one dat game
+UNDATTED = 'undatted'            #some file of the rom has no checksum in the dats
+NO_CHECKSUM = 'no checksum'      #the checksum of some file of the rom couldn't be calculated (missing dolphin-tool for rvz)
+PATCH_ERROR = 'patch error'      #the rxdelta of a file failed to apply
+INDEX_NOT_TEXT = 'not text'      #the cue/toc/gdi couldn't be read as text
+TRACK_MISSING = 'missing track'  #a track of the cue/toc/gdi is not a file
+TRACK_CHECKED = 'checked track'  #a track of the cue/toc/gdi was already part of another index file
+
+class EXENotFoundError(Exception):
+    def __init__(self, executable):
+        super().__init__()
+        self.executable = executable
+
+class PatchingError(Exception):
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors
+
+class CacheManifestError(Exception):
+    def __init__(self, manifest):
+        super().__init__()
+        self.manifest = manifest
+
+def which(executable):
+    flips = shutil.which(executable)
+    if not flips:
+        flips = shutil.which(executable, path=os.path.dirname(__file__))
+    if not flips:
+        flips = shutil.which(executable, path=os.getcwd())
+    if not flips:
+        raise EXENotFoundError(executable)
+    return flips
+
+#skip first n bytes (normally because it's a header that the dat doesn't record)
+def get_sha1(skip):
+    hash_sha1  = sha1()
+
+    buf = yield
+    buf = buf[skip:]
+
+    while len(buf) > 0:
+        hash_sha1.update(buf)
+        buf = yield
+
+    yield hash_sha1.hexdigest()
+
+def file_producer(source_filename, generator_function):
+    next(generator_function)
+    with open(source_filename, 'rb') as f:
+        for byt in iter(lambda:f.read(DEFAULT_BUFFER_SIZE), b''):
+            generator_function.send(byt)
+    return generator_function.send([])
+
+def producer_unix(arguments, generator_function):
+    ''' will append a output fifo to the end of the argument list prior to
+        applying the generator function to that fifo. Make sure the command
+        output is setup for the last argument to be a output file in the arguments
+    '''
+    #read and patchers write to the error stream so if there is a error
+    #(that corrupts the stream), it doesn't matter because the return code would
+    #be non-zero anyway
+    arguments.append("/dev/stderr") #not portable to windows
+    next(generator_function)
+    with subprocess.Popen(arguments, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as process:
+        for byt in process.stderr:
+            generator_function.send(byt)
+    #if a error occurred avoid writing bogus checksums
+    if process.returncode != 0:
+        raise PatchingError('error during patching')
+
+    return generator_function.send([])
+
+def producer_windows(arguments, generator_function):
+    ''' will append a tmp file to the end of the argument list prior to reading it and
+        applying the generator function to that file. Make sure the command
+        output is setup for the last argument to be a output file in the arguments
+    '''
+    #you can't even use a spooledtemporary file as a argument to a subprocess so it has to be a real
+    #file. Moreover, windows is even worse and requires a tmpdir instead of a tmp file to open it twice
+    
+    with tempfile.TemporaryDirectory() as d:
+        patched = Path(d,'rhdndat.tmp')
+        arguments.append(patched)
+        with subprocess.Popen(arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as process:
+            pass
+        #if a error occurred avoid writing bogus checksums
+        if process.returncode != 0:
+            raise PatchingError('error during patching')
+
+        return file_producer(patched, generator_function)
+
+def rxdelta_producer(source_filename, patch_filename, skip, xdelta):
+    ''' returns the sha1 of source_filename patched with the rxdelta patch_filename, skipping the first skip bytes.
+        Uses the builtin VCDIFF decoder, or xdelta3 if the rxdelta needs a feature the decoder doesn't have
+    '''
+    from rhdndat.vcdiff import vcdiff_producer, UnsupportedDeltaError
+    try:
+        return vcdiff_producer(source_filename, patch_filename, get_sha1(skip))
+    except UnsupportedDeltaError as e:
+        if not xdelta:
+            raise PatchingError(f'{e}, needs xdelta3 on its location, the current dir, or the OS path') from e
+    #do not reuse the generators
+    if os.name == 'nt':
+        return producer_windows([xdelta, '-d', '-s',  source_filename, patch_filename], get_sha1(skip))
+    return producer_unix([xdelta, '-d', '-s',  source_filename, patch_filename], get_sha1(skip))
+
+def read(x):
+    return x['user.rhdndat.rom_sha1'].decode('ascii')
+
+def cache_stat(rfile):
+    ''' returns the list of size and mtime of rfile, followed by the ones of its .rxdelta if it has one,
+        the cached checksum is only valid while these don't change
+    '''
+    stat = []
+    for f in ( rfile, rfile.with_suffix('.rxdelta') ):
+        if f is rfile or f.is_file():
+            st = f.stat()
+            stat += [st.st_size, st.st_mtime_ns]
+    return stat
+
+def same_stat(x, stat):
+    try:
+        cached = [ int(n) for n in x['user.rhdndat.rom_stat'].decode('ascii').split() ]
+    except (KeyError, ValueError) as e:
+        #checksums stored without the stat can't be checked
+        return False
+    if len(cached) != len(stat):
+        return False
+    #sizes and mtimes alternate
+    return all( c == n if i % 2 == 0 else same_mtime(c, n) for i, (c, n) in enumerate(zip(cached, stat)) )
+
+def needs_store(x, stat):
+    return 'user.rhdndat.rom_sha1' not in x or not same_stat(x, stat)
+    
+def store(x, sha1, stat):
+    x['user.rhdndat.rom_sha1'] = sha1.encode('ascii')
+    x['user.rhdndat.rom_stat'] = ' '.join(map(str, stat)).encode('ascii')
+
+def walk(romdir, skip):
+    ''' os.walk of romdir that doesn't descend into the skip directories
+    '''
+    for (root,dirs,dirfiles) in os.walk(romdir, topdown=True):
+        #don't walk down forbidden directories, backwards delete in place for os.walk to be notified
+        for i in range(len(dirs) - 1, -1, -1):
+            if Path(root, dirs[i]) in skip:
+                del dirs[i]
+        yield (root,dirs,dirfiles)
+
+def snapshot_dir(romdir, skip=[]):
+    ''' returns the list of (root, dirs, files) of walk(romdir, skip), so that a single traversal of
+        a (slow or network) directory tree can be used by scan_library and find_version_files
+    '''
+    return [ (root, list(dirs), dirfiles) for (root,dirs,dirfiles) in walk(romdir, skip) ]
+
+def same_mtime(mtime_ns, other_mtime_ns):
+    #copies to fat/exfat or by tools that truncate timestamps lose precision (fat has 2 second resolution)
+    return abs(mtime_ns - other_mtime_ns) <= 2_000_000_000
+
+def export_cache(romdir, skip, manifest, xattr):
+    ''' writes a json manifest of every file under romdir that has a cached checksum
+        with its path relative to romdir, size and mtime, so the cache can be restored
+        by import_cache after a copy that didn't preserve extended attributes.
+        returns the number of exported checksums
+    '''
+    entries = []
+    for (root,dirs,dirfiles) in walk(romdir, skip):
+        for name in dirfiles:
+            f = Path(root, name)
+            try:
+                x = xattr.xattr(f)
+                if needs_store(x, cache_stat(f)):
+                    continue
+                st = f.stat()
+                entries.append({ 'path': f.relative_to(romdir).as_posix(),
+                                 'size': st.st_size,
+                                 'mtime_ns': st.st_mtime_ns,
+                                 'sha1': read(x) })
+            except OSError as e:
+                warn(f'warn: could not read cached checksum of {link(f.parent.as_uri(),f.name + " (open dir)")}')
+    with open(manifest, 'w', encoding='utf-8') as m:
+        json.dump({ 'rhdndat_cache': 1, 'entries': entries }, m, indent=1)
+    return len(entries)
+
+def is_sha1(checksum):
+    return isinstance(checksum, str) and re.fullmatch(r'[0-9a-fA-F]{40}', checksum) is not None
+
+def is_int(number):
+    return isinstance(number, int) and not isinstance(number, bool)
+
+def import_cache(romdir, manifest, xattr, force):
+    ''' restores the cached checksums of a manifest made by export_cache to the files under romdir
+        that still have the same size and mtime. Files with a cached checksum are left alone unless forced.
+        raises CacheManifestError before storing anything if the manifest is invalid or has paths outside romdir.
+        returns the tuple (imported, stale), stale are manifest entries that no longer match a file
+    '''
+    try:
+        with open(manifest, 'r', encoding='utf-8') as m:
+            entries = json.load(m)['entries']
+    except (ValueError, KeyError, TypeError) as e:
+        raise CacheManifestError(manifest)
+    romdir = Path(os.path.abspath(romdir))
+    files = []
+    try:
+        for entry in entries:
+            #export_cache only writes relative paths without '..', anything else is not from it and could store outside romdir
+            f = Path(os.path.abspath(Path(romdir, *entry['path'].split('/'))))
+            if romdir not in f.parents:
+                raise CacheManifestError(manifest)
+            size, mtime_ns, checksum = entry['size'], entry['mtime_ns'], entry['sha1']
+            #a invalid checksum would be stored as if real, and the file reported as undatted until forced
+            if not is_sha1(checksum) or not is_int(size) or not is_int(mtime_ns):
+                raise CacheManifestError(manifest)
+            files.append((f, size, mtime_ns, checksum.lower()))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise CacheManifestError(manifest)
+    imported = 0
+    stale = 0
+    for f, size, mtime_ns, checksum in files:
+        try:
+            st = f.stat()
+            if st.st_size != size or not same_mtime(st.st_mtime_ns, mtime_ns):
+                stale += 1
+                continue
+            x = xattr.xattr(f)
+            stat = cache_stat(f)
+            if force or needs_store(x, stat):
+                store(x, checksum, stat)
+                imported += 1
+        except OSError as e:
+            stale += 1
+    return (imported, stale)
+
+def getChecksumDict(xmls_list):
+    def dictsetsum(dict1, game_tuple):
+        game, origin = game_tuple
+        game['origin'] = origin
+        for r in game.find_all('rom'):
+            dict1[r.get('sha1')].append(game)
+        return dict1
+    from bs4 import BeautifulSoup
+    lazy_sequence = ( (x,y) for y in xmls_list for x in BeautifulSoup(open(y), features="xml").find_all('game'))
+    return reduce(dictsetsum, lazy_sequence, defaultdict(list))
+
+
+def find_dats(xmlpath):
+    ''' returns the list of xml dats in xmlpath if it's a directory, or [xmlpath] if it's a file
+    '''
+    if xmlpath.is_file():
+        return [xmlpath]
+    elif xmlpath.is_dir():
+        return list(xmlpath.glob('**/*.dat')) + list(xmlpath.glob('**/*.xml'))
+    return []
+
+def load_dats(xmlpath):
+    ''' returns the dat index of the xml dat file or directory xmlpath, a dict of a rom sha1
+        to the list of dat 'game' elements that have that rom. Each game has the dat path
+        in the 'origin' attribute. The index can be reused for any number of scans
+    '''
+    return getChecksumDict(find_dats(xmlpath))
+
+def get_xattr():
+    ''' returns the xattr module or None if extended attributes can't be used to store checksums
+    '''
+    try:
+        import xattr
+        if "TERMUX_VERSION" in os.environ:
+            return None
+        return xattr
+    except Exception as e:
+        #windows and termux
+        return None
+
+class Tools(NamedTuple):
+    ''' the xattr module and the xdelta3 and dolphin-tool executables, any can be None if missing
+    '''
+    xattr: object
+    xdelta: Optional[str]
+    dolphin: Optional[str]
+
+def find_tools():
+    def which_or_none(executable):
+        try:
+            return which(executable)
+        except EXENotFoundError as e:
+            return None
+    return Tools(get_xattr(), which_or_none('xdelta3'), which_or_none('dolphin-tool'))
+
+def file_checksum(rfile, tools, force=False, skip=0):
+    ''' returns the sha1 of rfile, restored from the cache or calculated and stored in the cache.
+        The cache is only used if rfile (and its .rxdelta) have the same size and mtime as when it was stored.
+        If the file has a corresponding .rxdelta, it's applied before calculating the checksum (xdelta3 is only
+        needed for rxdelta the builtin decoder doesn't support), rvz/chd, since they're container formats should not have rxdelta.
+        returns None if the tool needed for the file is missing, raises PatchingError if the rxdelta fails
+    '''
+    xattr, xdelta, dolphin = tools
+    #do not reuse the generators
+    generator = get_sha1(skip)
+    checksum = None
+    if rfile.suffix.lower() == '.rvz':
+        if xattr:
+            x = xattr.xattr(rfile)
+            #before reading, so a change while reading is noticed the next time
+            stat = cache_stat(rfile)
+            should_store = force or needs_store(x, stat)
+            if should_store:
+                if dolphin:
+                    process = subprocess.run( [dolphin, 'verify', '-a', 'sha1', '-i', rfile], text=True, capture_output=True)
+                    process.check_returncode()
+                    checksum = process.stdout.strip()
+                    store(x, checksum, stat)
+            else:
+                checksum = read(x)
+        else:
+            if dolphin:
+                process = subprocess.run( [dolphin, 'verify', '-a', 'sha1', '-i', rfile], text=True, capture_output=True)
+                process.check_returncode()
+                checksum = process.stdout.strip()
+    else:
+        patch = rfile.with_suffix('.rxdelta')
+        if xattr:
+            x = xattr.xattr(rfile)
+            #before reading, so a change while reading is noticed the next time
+            stat = cache_stat(rfile)
+            should_store = force or needs_store(x, stat)
+            if patch.is_file():
+                if should_store:
+                    checksum = rxdelta_producer(rfile, patch, skip, xdelta)
+                    store(x, checksum, stat)
+                else:
+                    checksum = read(x)
+            else:
+                if should_store:
+                    checksum = file_producer(rfile, generator)
+                    store(x, checksum, stat)
+                else:
+                    checksum = read(x)
+        else:
+            if patch.is_file():
+                checksum = rxdelta_producer(rfile, patch, skip, xdelta)
+            else:
+               checksum = file_producer(rfile, generator)
+    return checksum
+
+class ScanResult(NamedTuple):
+    ''' path is the rom found in the scan, files the files checked for it (the tracks for cue/toc/gdi, otherwise [path]),
+        checksums the sha1 of the files checked until the first without a match, games the dat games where
+        all the files are, status one of the status constants, index_txt the text of a cue/toc/gdi or None and
+        error the reason of a PATCH_ERROR
+    '''
+    path: Path
+    files: List[Path]
+    checksums: List[str]
+    games: list
+    status: str
+    index_txt: Optional[str] = None
+    error: Optional[str] = None
+
+def scan_library(romdir, index, skip=[], ext=DEFAULT_EXTENSIONS, force=False, tools=None, snapshot=None):
+    ''' generator of a ScanResult for every rom with a extension in ext under romdir, not descending in the skip directories.
+        index is the dat index from load_dats, tools the Tools to use, found if None.
+        snapshot is a snapshot_dir of romdir to use instead of walking it again (skip is ignored then).
+        Checksums are restored from or stored to the cache like rhdndat-rn (unless forced to recalculate)
+    '''
+    if tools is None:
+        tools = find_tools()
+    ext = list(map( lambda s: s.lower() if s.startswith('.') else '.' + s.lower(), ext))
+    #nointro is no longer skipping headers in checksums.
+    headers = {}
+    savedtracks = set() #some track files have valid rom extensions, this is to prevent them being checked twice
+    if snapshot is None:
+        snapshot = walk(romdir, skip)
+    for (root,dirs,dirfiles) in snapshot:
+        #filter files in each directory to have only the extensions we want, sorted so index files come first
+        dirfiles = [ Path(root, p).resolve() for p in dirfiles if os.path.splitext(p)[1].lower() in ext ]
+        dirfiles.sort(key=lambda x: INDEX_EXTENSIONS.get(x.suffix.lower()) or 4)
+        for rom in dirfiles:
+            #skip any already processed track file
+            if rom in savedtracks:
+                continue
+            #always lowercase extensions even if the current file has a different case
+            suffix = rom.suffix.lower()
+            #check if needs to skip bytes
+            skipped = headers.get(suffix) or 0
+            #cues/gdi are handled especially to not have to bother confirming changing dozens of files (xattr are stored on track files)
+            files = []
+            index_txt = None
+            #Checking if file is binary/text has lots of false positives if you don't want to read it all (and even some if you do),
+            #Some wonderswan roms are marked as 'ISO-8859 text, with very long lines (65536), with no line terminators' by unix file utility.
+            if suffix in INDEX_EXTENSIONS:
+                #for cue/gdi/toc we do want to read it all so can easily check
+                try:
+                    with open(rom, 'tr') as f:
+                        index_txt = f.read()
+                    if not index_txt: raise Exception()
+                except:
+                    yield ScanResult(rom, [], [], [], INDEX_NOT_TEXT)
+                    continue
+                #instead of considering just the 'rom' file, consider also all file referenced inside cue or gdi or toc
+                #since toc and cue can have a single 'file' but multiple 'tracks' this needs a ordered set
+                if rom.suffix == '.gdi':
+                    regex = r'"(.*)"'
+                else:
+                    regex = r'FILE\s+"(.*)"'
+                class TrackAlreadyCheckedError(ValueError):
+                    '''already checked'''
+                def track_constructor(st):
+                    tmp = Path(st)
+                    if not tmp.is_absolute():
+                        tmp = Path(rom.parent, tmp)
+                    tmp = tmp.resolve()
+                    if not tmp.is_file():
+                        raise ValueError()
+                    if tmp in savedtracks:
+                        raise TrackAlreadyCheckedError()
+                    savedtracks.add(tmp)
+                    return tmp
+                #although a toc or a cue can point to the same file for different tracks, dats will only have '1' unique file
+                try:
+                    files = list(map( track_constructor, OrderedDict.fromkeys(re.findall(regex, index_txt)).keys() ))
+                except TrackAlreadyCheckedError:
+                    yield ScanResult(rom, [], [], [], TRACK_CHECKED, index_txt)
+                    continue
+                except:
+                    yield ScanResult(rom, [], [], [], TRACK_MISSING, index_txt)
+                    continue
+
+            if not files: #share the next loop
+                files = [ rom ]
+
+            games = None
+            checksums = []
+            status = MATCH
+            patch_error = None
+            #if any xdelta operation fails while iterating the rom/tracks, skip this rom
+            try:
+                #in the case of cues/gdi, check all
+                for rfile in files:
+                    sha1sum = file_checksum(rfile, tools, force, skipped)
+                    #find the games where all 'roms' checked are represented
+                    #for instance, we do not want to add games that share a music track like tombraider 1 and 2
+                    if not sha1sum:
+                        status = NO_CHECKSUM
+                        break
+                    if sha1sum not in index:
+                        status = UNDATTED
+                        break
+                    checksums.append(sha1sum)
+                    if games is None:
+                        games = set(index[sha1sum])
+                    else:
+                        games = games.intersection(index[sha1sum])
+            except PatchingError as e:
+                status = PATCH_ERROR
+                patch_error = str(e)
+            if status == MATCH and not games:
+                status = UNDATTED
+            yield ScanResult(rom, files, checksums, list(games) if status == MATCH else [], status, index_txt, patch_error)
@@ -0,0 +1,199 @@
+from hashlib import sha1
+from zlib import crc32
+from rhdndat.scan import PatchingError
+
+#order retroarch tries the softpatch formats in for each position in the chain
+SOFTPATCH_EXTENSIONS = ['.ips', '.bps', '.ups']
+
+def find_softpatches(rom):
+    ''' returns the list of softpatches of rom in the order retroarch applies them,
+        rom.ips/bps/ups followed by the retroarch numbered softpatches rom.ips1/bps1/ups1, rom.ips2...
+        until the numbered files do not exist. Like retroarch, numbered softpatches are only used after a unnumbered one.
+    '''
+    patches = []
+    for x in range(0, 100):
+        number = str(x) if x else ''
+        existing = [ p for p in ( rom.with_suffix(e + number) for e in SOFTPATCH_EXTENSIONS ) if p.is_file() ]
+        if not existing:
+            break
+        patches.append(existing[0])
+    return patches
+
+def decode_varint(patch, pos):
+    ''' returns the tuple (number, new position) of the ups/bps number encoding at pos
+    '''
+    data = 0
+    shift = 1
+    while True:
+        if pos >= len(patch):
+            raise PatchingError('truncated patch')
+        x = patch[pos]
+        pos += 1
+        data += (x & 0x7f) * shift
+        if x & 0x80:
+            return (data, pos)
+        shift <<= 7
+        data += shift
+
+def check_footer(patch):
+    ''' returns the tuple (source crc32, target crc32) of a ups/bps patch after checking the patch crc32
+    '''
+    if len(patch) < 16:
+        raise PatchingError('truncated patch')
+    source_crc = int.from_bytes(patch[-12:-8], 'little')
+    target_crc = int.from_bytes(patch[-8:-4], 'little')
+    if crc32(patch[:-4]) != int.from_bytes(patch[-4:], 'little'):
+        raise PatchingError('patch checksum mismatch, the patch is corrupt')
+    return (source_crc, target_crc)
+
+def apply_ips(source, patch):
+    ''' returns a bytearray of source patched with the ips patch
+    '''
+    if patch[:5] != b'PATCH':
+        raise PatchingError('not a ips patch')
+    target = bytearray(source)
+    pos = 5
+    end = len(patch)
+    while True:
+        if pos + 3 > end:
+            raise PatchingError('truncated patch')
+        #the end marker is also a valid offset, only a end marker if followed by nothing or a truncation
+        if patch[pos:pos+3] == b'EOF' and end - pos in (3, 6):
+            if end - pos == 6:
+                del target[int.from_bytes(patch[pos+3:pos+6], 'big'):]
+            return target
+        offset = int.from_bytes(patch[pos:pos+3], 'big')
+        size = int.from_bytes(patch[pos+3:pos+5], 'big')
+        pos += 5
+        if size:
+            data = patch[pos:pos+size]
+            pos += size
+        else:
+            #run length encoded record
+            size = int.from_bytes(patch[pos:pos+2], 'big')
+            data = patch[pos+2:pos+3] * size
+            pos += 3
+        if pos > end:
+            raise PatchingError('truncated patch')
+        if offset > len(target):
+            target.extend(bytes(offset - len(target)))
+        target[offset:offset+size] = data
+
+def apply_ups(source, patch):
+    ''' returns a bytearray of source patched with the ups patch, checking the crc32 of source and target.
+        Like other patchers, if source is the target of the patch, the patch is reversed
+    '''
+    if patch[:4] != b'UPS1':
+        raise PatchingError('not a ups patch')
+    source_crc, target_crc = check_footer(patch)
+    source_size, pos = decode_varint(patch, 4)
+    target_size, pos = decode_varint(patch, pos)
+    crc = crc32(source)
+    if len(source) == source_size and crc == source_crc:
+        expected_crc = target_crc
+    elif len(source) == target_size and crc == target_crc:
+        source_size, target_size = target_size, source_size
+        expected_crc = source_crc
+    else:
+        raise PatchingError('source checksum mismatch, the patch is for a different rom')
+    target = bytearray(source[:target_size])
+    target.extend(bytes(target_size - len(target)))
+    end = len(patch) - 12
+    offset = 0
+    while pos < end:
+        relative, pos = decode_varint(patch, pos)
+        offset += relative
+        #xor bytes until a zero byte, that also counts as a (unchanged) byte
+        stop = patch.find(b'\x00', pos, end)
+        if stop == -1:
+            raise PatchingError('truncated patch')
+        xor = patch[pos:stop]
+        pos = stop + 1
+        size = max(0, min(len(xor), target_size - offset))
+        if size:
+            patched = int.from_bytes(target[offset:offset+size], 'little') ^ int.from_bytes(xor[:size], 'little')
+            target[offset:offset+size] = patched.to_bytes(size, 'little')
+        offset += len(xor) + 1
+    if crc32(target) != expected_crc:
+        raise PatchingError('target checksum mismatch, the patch failed')
+    return target
+
+def apply_bps(source, patch):
+    ''' returns a bytearray of source patched with the bps patch, checking the crc32 of source and target
+    '''
+    if patch[:4] != b'BPS1':
+        raise PatchingError('not a bps patch')
+    source_crc, target_crc = check_footer(patch)
+    source_size, pos = decode_varint(patch, 4)
+    target_size, pos = decode_varint(patch, pos)
+    metadata_size, pos = decode_varint(patch, pos)
+    pos += metadata_size
+    if len(source) != source_size or crc32(source) != source_crc:
+        raise PatchingError('source checksum mismatch, the patch is for a different rom')
+    target = bytearray(target_size)
+    end = len(patch) - 12
+    out = 0
+    source_relative = 0
+    target_relative = 0
+    while pos < end:
+        data, pos = decode_varint(patch, pos)
+        command = data & 3
+        length = (data >> 2) + 1
+        if out + length > target_size:
+            raise PatchingError('patch writes past the end of the target')
+        if command == 0: #source read
+            if out + length > source_size:
+                raise PatchingError('patch reads past the end of the source')
+            target[out:out+length] = source[out:out+length]
+        elif command == 1: #target read
+            if pos + length > end:
+                raise PatchingError('truncated patch')
+            target[out:out+length] = patch[pos:pos+length]
+            pos += length
+        else:
+            data, pos = decode_varint(patch, pos)
+            relative = -(data >> 1) if data & 1 else data >> 1
+            if command == 2: #source copy
+                source_relative += relative
+                if source_relative < 0 or source_relative + length > source_size:
+                    raise PatchingError('patch reads past the end of the source')
+                target[out:out+length] = source[source_relative:source_relative+length]
+                source_relative += length
+            else: #target copy, can overlap the bytes being written to repeat a pattern
+                target_relative += relative
+                if target_relative < 0 or target_relative >= out:
+                    raise PatchingError('patch reads past the end of the target')
+                distance = out - target_relative
+                if distance >= length:
+                    target[out:out+length] = target[target_relative:target_relative+length]
+                else:
+                    pattern = target[target_relative:out]
+                    target[out:out+length] = (pattern * (length // distance + 1))[:length]
+                target_relative += length
+        out += length
+    if crc32(target) != target_crc:
+        raise PatchingError('target checksum mismatch, the patch failed')
+    return target
+
+def apply_patch(source, patchfile):
+    ''' returns a bytearray of source patched with the ips, ups or bps patchfile (including the numbered extensions)
+    '''
+    suffix = patchfile.suffix.lower().rstrip('0123456789')
+    appliers = { '.ips': apply_ips, '.ups': apply_ups, '.bps': apply_bps }
+    if suffix not in appliers:
+        raise PatchingError(f'unknown softpatch extension {patchfile.suffix}')
+    return appliers[suffix](source, patchfile.read_bytes())
+
+def softpatch_checksum(rom, patches=None):
+    ''' returns the sha1 of rom after applying the softpatches in order (by default the ones from find_softpatches),
+        in memory, reading rom once. Raises PatchingError if a patch is invalid or doesn't apply
+    '''
+    if patches is None:
+        patches = find_softpatches(rom)
+    data = rom.read_bytes()
+    for patch in patches:
+        try:
+            data = apply_patch(data, patch)
+        except PatchingError as e:
+            raise PatchingError(f'{patch.name}: {e}') from e
+    return sha1(data).hexdigest()
@@ -0,0 +1,238 @@
+'''
+VCDIFF (RFC 3284) decoder for the xdelta3 .rxdelta files, so they can be applied without starting a xdelta3 process.
+
+Supports the xdelta3 extensions (application header, window adler32 and lzma secondary compression,
+the default of xdelta3). The djw and fgk secondary compressors, custom code tables and windows that copy
+from the previous target raise UnsupportedDeltaError so the caller can use the xdelta3 executable instead.
+'''
+import lzma
+from zlib import adler32
+from rhdndat.scan import PatchingError
+
+class UnsupportedDeltaError(PatchingError):
+    def __init__(self, message):
+        super().__init__(message)
+
+#header indicator
+VCD_DECOMPRESS = 0x01
+VCD_CODETABLE = 0x02
+VCD_APPHEADER = 0x04 #xdelta3 extension
+#window indicator
+VCD_SOURCE = 0x01
+VCD_TARGET = 0x02
+VCD_ADLER32 = 0x04 #xdelta3 extension
+#delta indicator
+VCD_DATACOMP = 0x01
+VCD_INSTCOMP = 0x02
+VCD_ADDRCOMP = 0x04
+#xdelta3 secondary compressor ids
+SECONDARY_DJW = 1
+SECONDARY_LZMA = 2
+SECONDARY_FGK = 16
+
+NOOP, ADD, RUN, COPY = 0, 1, 2, 3
+NEAR_SIZE = 4
+SAME_SIZE = 3
+
+def default_code_table():
+    ''' returns the list of the 256 (type1, size1, mode1, type2, size2, mode2) instructions of RFC 3284 section 5.6
+    '''
+    table = [ (RUN, 0, 0, NOOP, 0, 0) ]
+    table += [ (ADD, size, 0, NOOP, 0, 0) for size in range(0, 18) ]
+    for mode in range(0, 9):
+        table += [ (COPY, size, mode, NOOP, 0, 0) for size in [0] + list(range(4, 19)) ]
+    for mode in range(0, 6):
+        table += [ (ADD, add, 0, COPY, copy, mode) for add in range(1, 5) for copy in range(4, 7) ]
+    for mode in range(6, 9):
+        table += [ (ADD, add, 0, COPY, 4, mode) for add in range(1, 5) ]
+    table += [ (COPY, 4, mode, ADD, 1, 0) for mode in range(0, 9) ]
+    return table
+
+CODE_TABLE = default_code_table()
+
+def read_varint(f):
+    ''' returns the VCDIFF integer read from the file f, or None at the end of the file
+    '''
+    value = 0
+    while True:
+        b = f.read(1)
+        if not b:
+            if value:
+                raise PatchingError('truncated rxdelta')
+            return None
+        x = b[0]
+        value = (value << 7) | (x & 0x7f)
+        if not x & 0x80:
+            return value
+
+def buffer_varint(buf, pos):
+    ''' returns the tuple (VCDIFF integer, new position) read from buf at pos
+    '''
+    value = 0
+    while True:
+        if pos >= len(buf):
+            raise PatchingError('truncated rxdelta')
+        x = buf[pos]
+        pos += 1
+        value = (value << 7) | (x & 0x7f)
+        if not x & 0x80:
+            return (value, pos)
+
+def read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise PatchingError('truncated rxdelta')
+    return data
+
+def decompress_section(section, decompressor):
+    ''' returns a xdelta3 secondary compressed section decompressed. xdelta3 compresses each kind of section
+        of all the windows as a single lzma stream, so the decompressor has to be the same for all of them
+    '''
+    size, pos = buffer_varint(section, 0)
+    try:
+        data = decompressor.decompress(section[pos:])
+    except lzma.LZMAError as e:
+        raise PatchingError('corrupt rxdelta secondary compression') from e
+    if len(data) != size:
+        raise PatchingError('corrupt rxdelta secondary compression')
+    return data
+
+def decode_window(source, data, inst, addr, target_size):
+    ''' returns the target window of the VCDIFF instructions, source is the source segment of the window
+    '''
+    target = bytearray()
+    source_size = len(source)
+    near = [0] * NEAR_SIZE
+    same = [0] * (SAME_SIZE * 256)
+    next_near = 0
+    dp = ip = ap = 0
+    inst_size = len(inst)
+    while ip < inst_size:
+        code = CODE_TABLE[inst[ip]]
+        ip += 1
+        for kind, size, mode in ( code[0:3], code[3:6] ):
+            if kind == NOOP:
+                continue
+            if size == 0:
+                size, ip = buffer_varint(inst, ip)
+            if kind == ADD:
+                if dp + size > len(data):
+                    raise PatchingError('corrupt rxdelta')
+                target += data[dp:dp+size]
+                dp += size
+            elif kind == RUN:
+                target += data[dp:dp+1] * size
+                dp += 1
+            else:
+                #address cache of RFC 3284 section 5.3
+                here = source_size + len(target)
+                if mode == 0:
+                    address, ap = buffer_varint(addr, ap)
+                elif mode == 1:
+                    offset, ap = buffer_varint(addr, ap)
+                    address = here - offset
+                elif mode < 2 + NEAR_SIZE:
+                    offset, ap = buffer_varint(addr, ap)
+                    address = near[mode - 2] + offset
+                else:
+                    if ap >= len(addr):
+                        raise PatchingError('corrupt rxdelta')
+                    address = same[(mode - 2 - NEAR_SIZE) * 256 + addr[ap]]
+                    ap += 1
+                near[next_near] = address
+                next_near = (next_near + 1) % NEAR_SIZE
+                same[address % (SAME_SIZE * 256)] = address
+                if address < 0 or address >= here:
+                    raise PatchingError('corrupt rxdelta')
+                if address < source_size:
+                    if address + size > source_size:
+                        raise PatchingError('corrupt rxdelta')
+                    target += source[address:address+size]
+                else:
+                    #copy from the target window, can overlap the bytes being written to repeat a pattern
+                    start = address - source_size
+                    distance = len(target) - start
+                    if distance >= size:
+                        target += target[start:start+size]
+                    else:
+                        target += (target[start:] * (size // distance + 1))[:size]
+    if len(target) != target_size:
+        raise PatchingError('corrupt rxdelta, wrong window size')
+    return target
+
+def decode_vcdiff(source_filename, patch_filename):
+    ''' generator of the target windows of the VCDIFF patch_filename applied to source_filename.
+        Only the source segment and target of one window are in memory at a time.
+    '''
+    with open(source_filename, 'rb') as src, open(patch_filename, 'rb') as f:
+        header = f.read(5)
+        if len(header) != 5 or header[:3] != b'\xd6\xc3\xc4' or header[3] != 0:
+            raise PatchingError('rxdelta is not a VCDIFF (xdelta3) file')
+        indicator = header[4]
+        secondary = None
+        if indicator & VCD_DECOMPRESS:
+            secondary = read_exactly(f, 1)[0]
+        if indicator & VCD_CODETABLE:
+            raise UnsupportedDeltaError('rxdelta uses a custom VCDIFF code table')
+        if indicator & VCD_APPHEADER:
+            read_exactly(f, read_varint(f) or 0)
+        decompressors = {}
+        while True:
+            b = f.read(1)
+            if not b:
+                return
+            window = b[0]
+            source = b''
+            if window & VCD_TARGET:
+                raise UnsupportedDeltaError('rxdelta copies from the previous target')
+            if window & VCD_SOURCE:
+                segment_size = read_varint(f)
+                segment_position = read_varint(f)
+                if segment_size is None or segment_position is None:
+                    raise PatchingError('truncated rxdelta')
+                src.seek(segment_position)
+                source = src.read(segment_size)
+                if len(source) != segment_size:
+                    raise PatchingError('rxdelta source is smaller than expected, may be caused by base rom replacement')
+            delta_size = read_varint(f)
+            target_size = read_varint(f)
+            if delta_size is None or target_size is None:
+                raise PatchingError('truncated rxdelta')
+            delta = read_exactly(f, 1)[0]
+            data_size = read_varint(f)
+            inst_size = read_varint(f)
+            addr_size = read_varint(f)
+            checksum = None
+            if window & VCD_ADLER32:
+                checksum = int.from_bytes(read_exactly(f, 4), 'big')
+            data = read_exactly(f, data_size)
+            inst = read_exactly(f, inst_size)
+            addr = read_exactly(f, addr_size)
+            if delta:
+                if secondary is None:
+                    raise PatchingError('corrupt rxdelta, compressed section without compressor')
+                if secondary != SECONDARY_LZMA:
+                    raise UnsupportedDeltaError(f'rxdelta uses the xdelta3 secondary compressor {secondary}, only lzma is builtin')
+                for kind in ( VCD_DATACOMP, VCD_INSTCOMP, VCD_ADDRCOMP ):
+                    if delta & kind and kind not in decompressors:
+                        decompressors[kind] = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+                if delta & VCD_DATACOMP:
+                    data = decompress_section(data, decompressors[VCD_DATACOMP])
+                if delta & VCD_INSTCOMP:
+                    inst = decompress_section(inst, decompressors[VCD_INSTCOMP])
+                if delta & VCD_ADDRCOMP:
+                    addr = decompress_section(addr, decompressors[VCD_ADDRCOMP])
+            target = decode_window(source, data, inst, addr, target_size)
+            if checksum is not None and adler32(target) != checksum:
+                raise PatchingError('rxdelta target checksum mismatch, may be caused by base rom replacement')
+            yield target
+
+def vcdiff_producer(source_filename, patch_filename, generator_function):
+    ''' applies the generator function to the result of the VCDIFF patch_filename applied to source_filename
+    '''
+    next(generator_function)
+    for window in decode_vcdiff(source_filename, patch_filename):
+        #get_sha1 takes a empty buffer as the end of the input
+        if window:
+            generator_function.send(window)
+    return generator_function.send([])
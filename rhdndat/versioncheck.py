@@ -0,0 +1,186 @@
+import typer
+from pathlib import Path
+from typing import Optional, List
+from rhdndat.common import warn, error, log, link
+from rhdndat.scan import walk
+
+class VersionFileSyntaxError(Exception):
+    def __init__(self, versionfile):
+        super().__init__()
+        self.versionfile = versionfile
+
+class RHDNTRomRemovedError(Exception):
+    def __init__(self, versionfile, url):
+        super().__init__()
+        self.versionfile = versionfile
+        self.url = url
+
+class VersionFileURLError(Exception):
+    def __init__(self, versionfile, url):
+        super().__init__()
+        self.versionfile = versionfile
+        self.url = url
+
+def is_rhdn_translation(url_str):
+    return 'www.romhacking.net/translations' in url_str
+
+def is_rhdn_hack(url_str):
+    return 'www.romhacking.net/hacks' in url_str
+
+def read_version_file(possible_metadata):
+    ''' returns list is a list of versions and urls of the used patches
+    '''
+    hacks_list = []
+    try:
+        with open(possible_metadata, 'r') as file_version:
+            while True:
+                version = file_version.readline()
+                url = file_version.readline()
+                assert ( version and url ) or ( not version and not url )
+                if not url: break
+                assert is_rhdn_translation(url) or is_rhdn_hack(url)
+                version = version.strip()
+                url = url.strip()
+                hacks_list += [(version, url)]
+    except Exception as e:
+        raise VersionFileSyntaxError(possible_metadata)
+    if not hacks_list:
+        raise VersionFileSyntaxError(possible_metadata)
+    return hacks_list
+
+def get_romhacking_data(possible_metadata, session):
+    ''' returns the tuple (metadata, language)
+        metadata is a list of (title, authors_string, version, url, remote_version) 1 for each hack
+        language is the last language of the hacks
+        session is a requests session, like the one from rhdn_session
+    '''
+    import requests
+    from bs4 import BeautifulSoup
+    metadata = []
+    language = None
+    version_hacks = read_version_file(possible_metadata)
+    #loop that can iterate on the same place with a continue without next
+    sentinel = object()
+    iterobj = iter(version_hacks)
+    x = next(iterobj, sentinel)
+    while x is not sentinel:
+        (version, url) = x
+        response = None
+        try:
+            response = session.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+            response.raise_for_status()
+            page = response.text
+            soup = BeautifulSoup(page, 'lxml')
+
+            #removed hacks from romhacking.net can be bad news, broken or malicious hacks
+            #warn the user to verify if he might have to remove the hack from the merge file
+            check_removed = soup.find('div', id='main')
+            if check_removed:
+                check_removed = check_removed.find('div', class_='topbar', string='Error Encountered!')
+                if check_removed:
+                    raise RHDNTRomRemovedError(possible_metadata, url)
+
+            info = soup.find('table', class_='entryinfo entryinfosmall').find('tbody')
+
+            #hacks have no language and translations shouldn't change it 2+ times
+            tmp  = info.find('th', string='Language')
+            tmp  = tmp and tmp.nextSibling.string
+            if tmp and language and tmp != language:
+                warn(f'warn: {language}->{tmp} : language should not have changed twice with patches from romhacking.net {link(possible_metadata.parent.as_uri(),"(open dir)")}')
+            if tmp:
+                language = tmp
+
+            authors = info.find('th', string='Released By').nextSibling
+            authors_str = authors.string
+            if not authors_str:
+                authors = authors.findAll('a')
+                authors_str = authors[0].string
+                for author in authors[1:-1]:
+                    authors_str += ', {}'.format(author.string)
+                authors_str += ' and {}'.format(authors[-1].string)
+
+            remote_version = info.find('th', string='Patch Version').nextSibling.string.strip()
+            if not remote_version:
+                raise VersionFileURLError(possible_metadata, url)
+
+            metadata += [(
+                info.find('div').string, #main title
+                authors_str,
+                version, #the version we actually have
+                url,
+                remote_version
+            )]
+            #advance loop, some exceptions retry the loop
+            x = next(iterobj, sentinel)
+        except requests.exceptions.RequestException as e:
+                error("error: no response, check your connection")
+                x = next(iterobj, sentinel)
+        except requests.exceptions.HTTPError as e:
+            if response.status_code == 429:
+                error("error: rate limited by cloudflare (429 Too Many Requests)")
+                continue
+            elif response.status_code == 403:
+                error("error: blocked by cloudflare (403 Forbidden)")
+                raise VersionFileURLError(possible_metadata, url)
+        except AttributeError as e:
+                error("error: romhacking.net changed its html, quitting")
+                raise VersionFileURLError(possible_metadata, url)
+    return (metadata, language)
+
+def find_version_files(romdir, skip=[], snapshot=None):
+    ''' returns a iterator of the rhdndat.ver files under romdir, not descending in the skip directories.
+        snapshot is a snapshot_dir of romdir to use instead of walking it again (skip is ignored then).
+    '''
+    if snapshot is None:
+        snapshot = walk(romdir, skip)
+    return ( Path(root, 'rhdndat.ver') for (root,dirs,dirfiles) in snapshot if 'rhdndat.ver' in dirfiles )
+
+def rhdn_session():
+    ''' returns a requests session rate limited to not be blocked by romhacking.net
+    '''
+    from requests_ratelimiter import LimiterSession
+    return LimiterSession(per_second=(2/3), burst=3)
+
+def check_versions(versions, show, abort=True):
+    ''' warns for every patch in the rhdndat.ver files of versions that has a different version in romhacking.net.
+        A invalid rhdndat.ver file or a romhacking.net failure stops the check, and aborts the program if abort
+    '''
+    try:
+        session = rhdn_session()
+        for possible_metadata in versions:
+            if show:
+                log(f'check: {link(possible_metadata.parent.as_uri(),possible_metadata.parent.name + " (open dir)")}') 
+            try:
+                metadata, _ = get_romhacking_data(possible_metadata, session)
+                for _, _, version, url, remote_version in metadata:
+                    if remote_version != version:
+                        warn(f'warn: local \'{version}\' {link(possible_metadata.parent.as_uri(),"(open dir)")} != remote \'{remote_version}\' {link(url, "(open url)")} versions')
+            except RHDNTRomRemovedError as e:
+                error(f'error: romhacking.net deleted the patch {link(e.url, "(open url)")} check reason and consider deletion {link(e.versionfile.parent.as_uri(),"(open dir)")}')
+    #fatal errors
+    except VersionFileURLError as e:
+        error(f'error: rhdndat.ver file {link(e.versionfile.as_uri(), "(open file)")} had a connection failure {link(e.url, "(open url)")}')
+    except VersionFileSyntaxError as e:
+        error(f'error: rhdndat.ver files should repeat two lines, a version string and a romhacking url {link(e.versionfile.as_uri(), "(open file)")}')
+    else:
+        return
+    if abort:
+        raise typer.Abort()
+    warn('warn: skipping the remaining version checks')
+
+def versioncheck(romdir: Path = typer.Argument(..., exists=True, file_okay=False, dir_okay=True, readable=True, resolve_path=True, help='Directory to search for versions to check.'),
+    skip: Optional[List[Path]] = typer.Option([], exists=True, file_okay=False, dir_okay=True, readable=True, resolve_path=True, help='Directory to skip, can be repeated.'),
+    show: bool = typer.Option(False, '--show', help='Show link to each checked directory.')
+    ):
+    """
+    romhacking.net update checker
+
+    rhdndat finds rhdndat.ver files to check for romhacking.net updates
+
+    A version file is named rhdndat.ver and has a version number line followed by a romhacking.net url line, repeated. These correspond to each hack or translation. To check for needed updates to version file, if any patch version in the file does not match the version on the romhacking.net patch page, it presents a warning.
+
+    To update this program to the latest release with pip installed, type:
+
+    pip install --force-reinstall rhdndat
+    """
+    check_versions(find_version_files(romdir, skip), show)
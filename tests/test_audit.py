@@ -0,0 +1,125 @@
+import os
+from hashlib import sha1
+import pytest
+from rhdndat.scan import NO_CHECKSUM, Tools, getChecksumDict, get_xattr, cache_stat, store
+from rhdndat.audit import audit_library
+
+#without xattr the checksums are not cached and without dolphin-tool rvz checksums are not calculated
+TOOLS = Tools(None, None, None)
+
+ROMS = {
+    'M1.iso': b'multi disc one',
+    'M2.iso': b'multi disc two',
+    'Single.nes': b'single',
+    'Absent.nes': b'absent',
+    'Disc.cue': b'index file',
+    'Disc (Track 1).bin': b'track one',
+    'Disc (Track 2).bin': b'track two',
+}
+
+def rom(name):
+    data = ROMS[name]
+    return f'<rom name="{name}" size="{len(data)}" sha1="{sha1(data).hexdigest()}"/>'
+
+@pytest.fixture
+def dat(tmp_path):
+    games = {
+        'Multi': ['M1.iso', 'M2.iso'],
+        'Single': ['Single.nes'],
+        'Absent': ['Absent.nes'],
+        'Disc': ['Disc.cue', 'Disc (Track 1).bin', 'Disc (Track 2).bin'],
+    }
+    xml = '<?xml version="1.0"?>\n<datafile>\n'
+    for name, roms in games.items():
+        xml += f'<game name="{name}">' + ''.join( rom(r) for r in roms ) + '</game>\n'
+    xml += '</datafile>\n'
+    path = tmp_path / 'test.dat'
+    path.write_text(xml)
+    return path
+
+def cue(*tracks):
+    return ''.join( f'FILE "{t}" BINARY\n  TRACK {i:02} MODE1/2352\n    INDEX 01 00:00:00\n' for i, t in enumerate(tracks, 1) )
+
+def audit(romdir, dat, tools=TOOLS):
+    report = audit_library(romdir, getChecksumDict([dat]), tools=tools)
+    return report, report['dats'][str(dat)]
+
+def test_have_partial_missing(tmp_path, dat):
+    romdir = tmp_path / 'roms'
+    romdir.mkdir()
+    for name in ['M1.iso', 'Single.nes']:
+        (romdir / name).write_bytes(ROMS[name])
+    (romdir / 'Unknown.nes').write_bytes(b'not in the dat')
+    report, result = audit(romdir, dat)
+    assert result['have'] == [{ 'game': 'Single', 'files': ['Single.nes'] }]
+    assert result['partial'] == [{ 'game': 'Multi', 'files': ['M1.iso'], 'missing': ['M2.iso'] }]
+    assert sorted(result['missing']) == ['Absent', 'Disc']
+    assert result['misnamed'] == []
+    assert report['unknown'] == ['Unknown.nes']
+    assert report['errors'] == []
+
+def test_index_file_is_not_required(tmp_path, dat):
+    romdir = tmp_path / 'roms'
+    romdir.mkdir()
+    (romdir / 'Disc.cue').write_text(cue('Disc (Track 1).bin', 'Disc (Track 2).bin'))
+    for name in ['Disc (Track 1).bin', 'Disc (Track 2).bin']:
+        (romdir / name).write_bytes(ROMS[name])
+    report, result = audit(romdir, dat)
+    assert result['have'] == [{ 'game': 'Disc', 'files': ['Disc.cue'] }]
+    assert result['partial'] == []
+    assert result['misnamed'] == []
+
+@pytest.mark.parametrize('index, tracks', [
+    #the index file can't take the name of a track
+    ('Disc (Track 1).cue', ['Disc (Track 1).bin', 'Disc (Track 2).bin']),
+    ('Disc.cue', ['track 1.bin', 'track 2.bin']),
+])
+def test_misnamed_index(tmp_path, dat, index, tracks):
+    romdir = tmp_path / 'roms'
+    romdir.mkdir()
+    (romdir / index).write_text(cue(*tracks))
+    for track, name in zip(tracks, ['Disc (Track 1).bin', 'Disc (Track 2).bin']):
+        (romdir / track).write_bytes(ROMS[name])
+    report, result = audit(romdir, dat)
+    assert result['misnamed'] == [{ 'game': 'Disc', 'file': index, 'expected': ['Disc.cue', 'Disc (Track 1).bin', 'Disc (Track 2).bin'] }]
+
+def test_swapped_tracks_are_misnamed(tmp_path, dat):
+    romdir = tmp_path / 'roms'
+    romdir.mkdir()
+    (romdir / 'Disc.cue').write_text(cue('Disc (Track 2).bin', 'Disc (Track 1).bin'))
+    (romdir / 'Disc (Track 2).bin').write_bytes(ROMS['Disc (Track 1).bin'])
+    (romdir / 'Disc (Track 1).bin').write_bytes(ROMS['Disc (Track 2).bin'])
+    report, result = audit(romdir, dat)
+    assert [ m['file'] for m in result['misnamed'] ] == ['Disc.cue']
+
+def test_unavailable_checksum_is_an_error(tmp_path, dat):
+    romdir = tmp_path / 'roms'
+    romdir.mkdir()
+    (romdir / 'Game.rvz').write_bytes(b'needs dolphin-tool')
+    report, result = audit(romdir, dat)
+    assert report['unknown'] == []
+    assert report['errors'] == [{ 'file': 'Game.rvz', 'status': NO_CHECKSUM, 'error': None }]
+
+def test_changed_rom_is_read_again(tmp_path, dat):
+    xattr = get_xattr()
+    if not xattr:
+        pytest.skip('no extended attributes')
+    tools = Tools(xattr, None, None)
+    romdir = tmp_path / 'roms'
+    romdir.mkdir()
+    rom = romdir / 'Single.nes'
+    try:
+        #a unchanged rom uses the cached checksum
+        rom.write_bytes(b'cached')
+        store(xattr.xattr(rom), sha1(ROMS['Single.nes']).hexdigest(), cache_stat(rom))
+    except OSError:
+        pytest.skip('the filesystem has no user extended attributes')
+    report, result = audit(romdir, dat, tools)
+    assert result['have'] == [{ 'game': 'Single', 'files': ['Single.nes'] }]
+    #replaced in place by another rom of the same size
+    st = rom.stat()
+    rom.write_bytes(ROMS['Absent.nes'])
+    os.utime(rom, ns=(st.st_atime_ns, st.st_mtime_ns + 10_000_000_000))
+    report, result = audit(romdir, dat, tools)
+    assert result['have'] == [{ 'game': 'Absent', 'files': ['Single.nes'] }]
+    assert result['misnamed'] == [{ 'game': 'Absent', 'file': 'Single.nes', 'expected': ['Absent.nes'] }]
@@ -0,0 +1,121 @@
+import os
+import json
+from hashlib import sha1
+import pytest
+from rhdndat.scan import CacheManifestError, get_xattr, read, cache_stat, needs_store, store, export_cache, import_cache
+
+FILES = { 'a.nes': b'first rom', 'sub/b.nes': b'second rom', 'sub/c.nes': b'third rom' }
+
+@pytest.fixture
+def xattr(tmp_path):
+    xattr = get_xattr()
+    if not xattr:
+        pytest.skip('no extended attributes')
+    try:
+        xattr.xattr(tmp_path)['user.rhdndat.test'] = b'1'
+    except OSError:
+        pytest.skip('the filesystem has no user extended attributes')
+    return xattr
+
+def uncached(xattr, f):
+    return needs_store(xattr.xattr(f), cache_stat(f))
+
+def make_romdir(romdir, xattr):
+    for name, data in FILES.items():
+        f = romdir / name
+        f.parent.mkdir(parents=True, exist_ok=True)
+        f.write_bytes(data)
+        store(xattr.xattr(f), sha1(data).hexdigest(), cache_stat(f))
+
+def copy_without_xattrs(romdir, copy):
+    for name in FILES:
+        source = romdir / name
+        f = copy / name
+        f.parent.mkdir(parents=True, exist_ok=True)
+        f.write_bytes(source.read_bytes())
+        st = source.stat()
+        os.utime(f, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+def test_export_import(tmp_path, xattr):
+    romdir = tmp_path / 'roms'
+    copy = tmp_path / 'copy'
+    manifest = tmp_path / 'cache.json'
+    make_romdir(romdir, xattr)
+    assert export_cache(romdir, [], manifest, xattr) == len(FILES)
+    copy_without_xattrs(romdir, copy)
+    assert all( uncached(xattr, copy / name) for name in FILES )
+    #a changed rom keeps the size but not the mtime, a different rom has a different size
+    st = (copy / 'sub/b.nes').stat()
+    os.utime(copy / 'sub/b.nes', ns=(st.st_atime_ns, st.st_mtime_ns + 3_600_000_000_000))
+    (copy / 'sub/c.nes').write_bytes(b'a different rom')
+    assert import_cache(copy, manifest, xattr, False) == (1, 2)
+    assert read(xattr.xattr(copy / 'a.nes')) == sha1(FILES['a.nes']).hexdigest()
+    assert uncached(xattr, copy / 'sub/b.nes')
+    assert uncached(xattr, copy / 'sub/c.nes')
+    #already cached files are only replaced if forced
+    assert import_cache(copy, manifest, xattr, False) == (0, 2)
+    assert import_cache(copy, manifest, xattr, True) == (1, 2)
+
+def test_changed_file_needs_store(tmp_path, xattr):
+    make_romdir(tmp_path, xattr)
+    assert not uncached(xattr, tmp_path / 'a.nes')
+    #the rxdelta is part of the checksum of the rom it patches
+    (tmp_path / 'a.rxdelta').write_bytes(b'patch')
+    assert uncached(xattr, tmp_path / 'a.nes')
+    (tmp_path / 'a.rxdelta').unlink()
+    assert not uncached(xattr, tmp_path / 'a.nes')
+    st = (tmp_path / 'a.nes').stat()
+    os.utime(tmp_path / 'a.nes', ns=(st.st_atime_ns, st.st_mtime_ns + 3_000_000_000))
+    assert uncached(xattr, tmp_path / 'a.nes')
+    #checksums stored without the size and mtime are not trusted
+    x = xattr.xattr(tmp_path / 'sub/b.nes')
+    del x['user.rhdndat.rom_stat']
+    assert uncached(xattr, tmp_path / 'sub/b.nes')
+
+@pytest.mark.parametrize('path', ['../outside.nes', 'sub/../../outside.nes'])
+def test_import_outside_romdir(tmp_path, xattr, path):
+    romdir = tmp_path / 'roms'
+    romdir.mkdir()
+    inside = romdir / 'inside.nes'
+    inside.write_bytes(b'inside')
+    outside = tmp_path / 'outside.nes'
+    outside.write_bytes(b'outside')
+    entries = []
+    for f, relative in [ (inside, 'inside.nes'), (outside, path) ]:
+        st = f.stat()
+        entries.append({ 'path': relative, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': '0' * 40 })
+    manifest = tmp_path / 'cache.json'
+    manifest.write_text(json.dumps({ 'rhdndat_cache': 1, 'entries': entries }))
+    with pytest.raises(CacheManifestError):
+        import_cache(romdir, manifest, xattr, True)
+    #nothing is stored from a rejected manifest
+    assert uncached(xattr, inside)
+    assert uncached(xattr, outside)
+
+def test_import_not_a_manifest(tmp_path, xattr):
+    manifest = tmp_path / 'cache.json'
+    manifest.write_text('{"entries": [{"path": 1}]}')
+    with pytest.raises(CacheManifestError):
+        import_cache(tmp_path, manifest, xattr, False)
+
+@pytest.mark.parametrize('field, value', [
+    ('sha1', 'é'), ('sha1', 12), ('sha1', 'not a checksum'), ('sha1', '0' * 41),
+    ('size', '9'), ('size', True), ('mtime_ns', 1.5), ('mtime_ns', None),
+])
+def test_import_invalid_entry(tmp_path, xattr, field, value):
+    romdir = tmp_path / 'roms'
+    romdir.mkdir()
+    entries = []
+    for name in ['first.nes', 'second.nes']:
+        f = romdir / name
+        f.write_bytes(b'rom')
+        st = f.stat()
+        entries.append({ 'path': name, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1(b'rom').hexdigest() })
+    entries[1][field] = value
+    manifest = tmp_path / 'cache.json'
+    manifest.write_text(json.dumps({ 'rhdndat_cache': 1, 'entries': entries }))
+    with pytest.raises(CacheManifestError):
+        import_cache(romdir, manifest, xattr, False)
+    #nothing is stored from a rejected manifest
+    assert uncached(xattr, romdir / 'first.nes')
+    assert uncached(xattr, romdir / 'second.nes')
@@ -0,0 +1,21 @@
+import re
+import sys
+import subprocess
+from pathlib import Path
+import pytest
+
+#modules that only some commands need, and are slow to import
+HEAVY = ['requests', 'requests_ratelimiter', 'bs4', 'lxml', 'questionary', 'prompt_toolkit']
+
+def imported_modules(module):
+    ''' returns the set of top level modules imported by 'import module', from -X importtime
+    '''
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             capture_output=True, text=True, cwd=Path(__file__).parent.parent, check=True)
+    names = re.findall(r'^import time:\s+\d+ \|\s+\d+ \|\s*(\S+)$', process.stderr, re.MULTILINE)
+    assert module in names
+    return { n.split('.')[0] for n in names }
+
+@pytest.mark.parametrize('module', ['rhdndat.__main__', 'rhdndat.renamer', 'rhdndat.versioncheck', 'rhdndat.audit'])
+def test_heavy_imports_are_deferred(module):
+    assert not imported_modules(module).intersection(HEAVY)
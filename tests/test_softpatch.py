@@ -0,0 +1,219 @@
+import random
+from hashlib import sha1
+from zlib import crc32
+import pytest
+from rhdndat.scan import PatchingError
+from rhdndat.softpatch import decode_varint, apply_ips, apply_ups, apply_bps, find_softpatches, softpatch_checksum
+
+def encode_varint(number):
+    out = bytearray()
+    while True:
+        x = number & 0x7f
+        number >>= 7
+        if not number:
+            out.append(0x80 | x)
+            return out
+        out.append(x)
+        number -= 1
+
+def footer(patch, source, target):
+    patch += crc32(source).to_bytes(4, 'little') + crc32(target).to_bytes(4, 'little')
+    patch += crc32(patch).to_bytes(4, 'little')
+    return bytes(patch)
+
+def make_ups(source, target):
+    patch = bytearray(b'UPS1') + encode_varint(len(source)) + encode_varint(len(target))
+    size = max(len(source), len(target))
+    byte = lambda data, i: data[i] if i < len(data) else 0
+    last = 0
+    i = 0
+    while i < size:
+        if byte(source, i) == byte(target, i):
+            i += 1
+            continue
+        patch += encode_varint(i - last)
+        while i < size and byte(source, i) != byte(target, i):
+            patch.append(byte(source, i) ^ byte(target, i))
+            i += 1
+        patch.append(0)
+        i += 1
+        last = i
+    return footer(patch, source, target)
+
+def variation(data, seed, size):
+    rng = random.Random(seed)
+    target = bytearray(data[:size])
+    target.extend(rng.randbytes(size - len(target)))
+    for x in range(0, 20):
+        target[rng.randrange(size)] = rng.randrange(256)
+    return bytes(target)
+
+SOURCE = random.Random(31).randbytes(4096)
+
+@pytest.mark.parametrize('size', [4096, 5000, 3000], ids=['same size', 'growing', 'shrinking'])
+def test_ups(size):
+    target = variation(SOURCE, size, size)
+    patch = make_ups(SOURCE, target)
+    assert apply_ups(SOURCE, patch) == target
+    #applying it to the target reverses it
+    assert apply_ups(target, patch) == SOURCE
+
+def test_ups_different_rom():
+    patch = make_ups(SOURCE, variation(SOURCE, 1, 4096))
+    with pytest.raises(PatchingError, match='source checksum mismatch'):
+        apply_ups(variation(SOURCE, 2, 4096), patch)
+
+def test_ups_corrupt_patch():
+    patch = bytearray(make_ups(SOURCE, variation(SOURCE, 1, 4096)))
+    patch[8] ^= 1
+    with pytest.raises(PatchingError, match='patch checksum mismatch'):
+        apply_ups(SOURCE, bytes(patch))
+
+def match_length(a, a_start, b, b_start):
+    length = 0
+    while a_start + length < len(a) and b_start + length < len(b) and a[a_start+length] == b[b_start+length]:
+        length += 1
+    return length
+
+def make_bps(source, target):
+    ''' greedy bps encoder, uses source reads, then source copies, then target copies of at least 8 bytes
+    '''
+    patch = bytearray(b'BPS1') + encode_varint(len(source)) + encode_varint(len(target)) + encode_varint(0)
+    source_blocks = {}
+    for i in range(len(source) - 7):
+        source_blocks.setdefault(source[i:i+8], i)
+    target_blocks = {}
+    pending = bytearray()
+    relative = { 'source': 0, 'target': 0 }
+    def action(command, length):
+        patch.extend(encode_varint(((length - 1) << 2) | command))
+    def offset(kind, start, length):
+        difference = start - relative[kind]
+        patch.extend(encode_varint((abs(difference) << 1) | (difference < 0)))
+        relative[kind] = start + length
+    def target_read():
+        if pending:
+            action(1, len(pending))
+            patch.extend(pending)
+            pending.clear()
+    out = 0
+    while out < len(target):
+        block = target[out:out+8]
+        read = match_length(source, out, target, out)
+        copy_start = source_blocks.get(block)
+        target_start = target_blocks.get(block)
+        if read >= 8:
+            target_read()
+            action(0, read)
+            length = read
+        elif copy_start is not None:
+            target_read()
+            length = match_length(source, copy_start, target, out)
+            action(2, length)
+            offset('source', copy_start, length)
+        elif target_start is not None:
+            #can overlap the bytes being written
+            target_read()
+            length = match_length(target, target_start, target, out)
+            action(3, length)
+            offset('target', target_start, length)
+        else:
+            pending.append(target[out])
+            length = 1
+        for i in range(out, out + length):
+            target_blocks.setdefault(target[i:i+8], i)
+        out += length
+    target_read()
+    return footer(patch, source, target)
+
+def bps_commands(patch):
+    ''' returns the set of the commands in a patch made by make_bps
+    '''
+    commands = set()
+    pos = 4
+    for x in range(0, 3):
+        data, pos = decode_varint(patch, pos)
+    while pos < len(patch) - 12:
+        data, pos = decode_varint(patch, pos)
+        commands.add(data & 3)
+        if data & 3 == 1:
+            pos += (data >> 2) + 1
+        elif data & 3 > 1:
+            data, pos = decode_varint(patch, pos)
+    return commands
+
+@pytest.mark.parametrize('size', [4096, 5000, 3000], ids=['same size', 'growing', 'shrinking'])
+def test_bps(size):
+    #repeat parts so the diff uses source and target copies
+    target = variation(SOURCE, size, size)
+    target = target[:size//2] + SOURCE[100:600] + target[:300] + bytes(100) + target[size//2:]
+    patch = make_bps(SOURCE, target)
+    assert bps_commands(patch) == {0, 1, 2, 3}
+    assert apply_bps(SOURCE, patch) == target
+
+def test_bps_different_rom():
+    patch = make_bps(SOURCE, variation(SOURCE, 1, 4096))
+    with pytest.raises(PatchingError, match='source checksum mismatch'):
+        apply_bps(variation(SOURCE, 2, 4096), patch)
+
+def ips_record(offset, data):
+    return offset.to_bytes(3, 'big') + len(data).to_bytes(2, 'big') + data
+
+def ips_rle(offset, size, value):
+    return offset.to_bytes(3, 'big') + bytes(2) + size.to_bytes(2, 'big') + bytes([value])
+
+def test_ips():
+    patch = b'PATCH' + ips_record(10, b'abc') + ips_rle(20, 5, 0x7f) + b'EOF'
+    target = bytearray(SOURCE)
+    target[10:13] = b'abc'
+    target[20:25] = b'\x7f' * 5
+    assert apply_ips(SOURCE, patch) == target
+
+def test_ips_grows_and_truncates():
+    patch = b'PATCH' + ips_record(len(SOURCE) + 2, b'end') + b'EOF'
+    assert apply_ips(SOURCE, patch) == SOURCE + bytes(2) + b'end'
+    #the truncation extension is the size after the end marker
+    patch = b'PATCH' + ips_record(0, b'start') + b'EOF' + (1000).to_bytes(3, 'big')
+    assert apply_ips(SOURCE, patch) == b'start' + SOURCE[5:1000]
+
+def test_ips_record_at_eof_offset():
+    #0x454F46 is 'EOF', only a end marker at the end of the patch
+    patch = b'PATCH' + ips_record(0x454F46, b'x') + ips_record(0, b'y') + b'EOF'
+    target = apply_ips(SOURCE, patch)
+    assert len(target) == 0x454F47
+    assert target[0x454F46:] == b'x'
+    assert target[:len(SOURCE)] == b'y' + SOURCE[1:]
+
+def test_ips_truncated():
+    with pytest.raises(PatchingError):
+        apply_ips(SOURCE, b'PATCH' + ips_record(0, b'abc')[:6])
+
+def test_softpatch_chain(tmp_path):
+    rom = tmp_path / 'Game.nes'
+    rom.write_bytes(SOURCE)
+    first = variation(SOURCE, 1, 4096)
+    second = variation(first, 2, 5000)
+    (tmp_path / 'Game.ups').write_bytes(make_ups(SOURCE, first))
+    (tmp_path / 'Game.ips1').write_bytes(b'PATCH' + ips_record(0, second[:4096]) + ips_record(4096, second[4096:]) + b'EOF')
+    (tmp_path / 'Game.ips3').write_bytes(b'PATCH' + b'EOF') #not in the chain, there is no .ips2
+    assert find_softpatches(rom) == [tmp_path / 'Game.ups', tmp_path / 'Game.ips1']
+    assert softpatch_checksum(rom) == sha1(second).hexdigest()
+    (tmp_path / 'Game.ups').write_bytes(make_ups(second, first))
+    with pytest.raises(PatchingError, match='Game.ups'):
+        softpatch_checksum(rom)
+
+def test_softpatch_order(tmp_path):
+    rom = tmp_path / 'Game.nes'
+    rom.write_bytes(SOURCE)
+    for name in ['Game.ups', 'Game.bps', 'Game.ips', 'Game.ups1', 'Game.bps1', 'Game.ups2']:
+        (tmp_path / name).write_bytes(b'')
+    #like retroarch, ips is tried before bps and bps before ups
+    assert find_softpatches(rom) == [tmp_path / 'Game.ips', tmp_path / 'Game.bps1', tmp_path / 'Game.ups2']
+
+def test_numbered_softpatches_need_a_unnumbered_one(tmp_path):
+    rom = tmp_path / 'Game.nes'
+    rom.write_bytes(SOURCE)
+    (tmp_path / 'Game.ips1').write_bytes(b'PATCH' + ips_record(0, b'x') + b'EOF')
+    (tmp_path / 'Game.ips2').write_bytes(b'PATCH' + ips_record(1, b'y') + b'EOF')
+    assert find_softpatches(rom) == []
+    assert softpatch_checksum(rom) == sha1(SOURCE).hexdigest()
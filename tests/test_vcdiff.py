@@ -0,0 +1,51 @@
+'''
+The fixtures were made with xdelta3 3.1.1 from base.bin to a 53KB target:
+
+    xdelta3 -e -s base.bin target.bin lzma.xd               (default lzma secondary compression)
+    xdelta3 -e -S none -s base.bin target.bin none.xd
+    xdelta3 -e -W 16384 -s base.bin target.bin windows.xd   (4 windows)
+    xdelta3 -e -S djw -s base.bin target.bin djw.xd
+    xdelta3 -e -s base.bin empty empty.xd                   (empty target)
+
+wrong.bin is base.bin with 10 bytes changed.
+'''
+from hashlib import sha1
+from pathlib import Path
+import pytest
+from rhdndat.scan import PatchingError, get_sha1, rxdelta_producer
+from rhdndat.vcdiff import UnsupportedDeltaError, decode_vcdiff, vcdiff_producer
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'vcdiff'
+BASE = FIXTURES / 'base.bin'
+TARGET_SHA1 = '5debbef15becda4633d517cb0b92970ca3c89a5a'
+EMPTY_SHA1 = 'da39a3ee5e6b4b0d3255bfef95601890afd80709'
+
+@pytest.mark.parametrize('patch', ['lzma.xd', 'none.xd', 'windows.xd'])
+def test_decode_matches_xdelta3(patch):
+    assert vcdiff_producer(BASE, FIXTURES / patch, get_sha1(0)) == TARGET_SHA1
+
+def test_multiple_windows_share_the_lzma_streams():
+    windows = list(decode_vcdiff(BASE, FIXTURES / 'windows.xd'))
+    assert len(windows) > 1
+    assert sha1(b''.join(windows)).hexdigest() == TARGET_SHA1
+
+def test_empty_target():
+    assert vcdiff_producer(BASE, FIXTURES / 'empty.xd', get_sha1(0)) == EMPTY_SHA1
+    assert rxdelta_producer(BASE, FIXTURES / 'empty.xd', 0, None) == EMPTY_SHA1
+
+@pytest.mark.parametrize('patch', ['lzma.xd', 'none.xd', 'windows.xd'])
+def test_wrong_base_rom(patch):
+    with pytest.raises(PatchingError):
+        vcdiff_producer(FIXTURES / 'wrong.bin', FIXTURES / patch, get_sha1(0))
+
+def test_djw_is_unsupported():
+    with pytest.raises(UnsupportedDeltaError):
+        vcdiff_producer(BASE, FIXTURES / 'djw.xd', get_sha1(0))
+
+def test_djw_without_xdelta3_is_a_patching_error():
+    with pytest.raises(PatchingError, match='xdelta3'):
+        rxdelta_producer(BASE, FIXTURES / 'djw.xd', 0, None)
+
+def test_not_a_vcdiff():
+    with pytest.raises(PatchingError):
+        vcdiff_producer(BASE, BASE, get_sha1(0))
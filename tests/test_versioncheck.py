@@ -0,0 +1,25 @@
+from hashlib import sha1
+import pytest
+import typer
+from typer.testing import CliRunner
+from rhdndat.versioncheck import check_versions, find_version_files
+from rhdndat.renamer import renamer
+
+def test_invalid_version_file_aborts(tmp_path):
+    (tmp_path / 'rhdndat.ver').write_text('1.0\nnot a romhacking.net url\n')
+    with pytest.raises(typer.Abort):
+        check_versions(find_version_files(tmp_path), False)
+    #without abort the check just stops
+    check_versions(find_version_files(tmp_path), False, abort=False)
+
+def test_renamer_continues_after_version_check_failure(tmp_path):
+    (tmp_path / 'rhdndat.ver').write_text('1.0\nnot a romhacking.net url\n')
+    (tmp_path / 'Game.nes').write_bytes(b'rom')
+    dat = tmp_path / 'test.dat'
+    dat.write_text(f'<?xml version="1.0"?>\n<datafile><game name="Game"><rom name="Game.nes" size="3" sha1="{sha1(b"rom").hexdigest()}"/></game></datafile>\n')
+    app = typer.Typer()
+    app.command()(renamer)
+    result = CliRunner().invoke(app, [str(tmp_path), str(dat), '--check-versions', '--no-rename', '--verbose'])
+    assert result.exit_code == 0, result.output
+    assert 'rhdndat.ver files should repeat two lines' in result.output
+    assert 'skipping the remaining version checks' in result.output